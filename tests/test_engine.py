@@ -0,0 +1,52 @@
+# coding: utf-8
+
+"""
+    The engine registry of `xlreport.engine`.
+"""
+
+import unittest
+
+from xlreport import engine
+from xlreport.engine import LazyEngine, get_engine, register_engine
+
+
+class DummyEngine(object):
+
+    @staticmethod
+    def get_child(node, tag):
+        return node.get(tag, '')
+
+
+class EngineRegistryTest(unittest.TestCase):
+
+    def tearDown(self):
+        engine._registry.pop('dummy', None)
+        engine._loaded.pop('dummy', None)
+
+    def test_spec_imported_on_use(self):
+        register_engine('dummy', __name__ + ':DummyEngine')
+        self.assertTrue(get_engine('dummy') is DummyEngine)
+
+    def test_lazy_engine_resolved(self):
+        register_engine('dummy', DummyEngine)
+        lazy = LazyEngine('dummy')
+        self.assertTrue(get_engine(lazy) is DummyEngine)
+        self.assertEqual(lazy.get_child({'a': 'x'}, 'a'), 'x')
+
+    def test_class_passed_through(self):
+        self.assertTrue(get_engine(DummyEngine) is DummyEngine)
+
+    def test_subclass(self):
+        register_engine('dummy', DummyEngine)
+
+        class MyEngine(get_engine(LazyEngine('dummy'))):
+            pass
+
+        self.assertTrue(issubclass(MyEngine, DummyEngine))
+
+    def test_unknown(self):
+        self.assertRaises(KeyError, get_engine, 'no-such-engine')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# coding: utf-8
+
+"""
+    Filters applied to whole group columns by `apply_filters`.
+"""
+
+import unittest
+
+from xlreport.excel import apply_filters
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.calls = []
+
+
+class BatchFilter(object):
+
+    def __init__(self, recorder, args):
+        self.recorder = recorder
+        self.suffix = args[0]
+
+    def apply_batch(self, sheet, col, values, rows, ref_rows, ori_rows, ori_cols):
+        self.recorder.calls.append(('batch', col, tuple(rows)))
+        return [v + self.suffix for v in values]
+
+
+class CellFilter(object):
+
+    def __init__(self, recorder, args):
+        self.recorder = recorder
+
+    def apply(self, sheet, row, col, value, ref_row, ori_row, ori_col):
+        self.recorder.calls.append(('cell', col, row))
+        return value.upper()
+
+
+def make_cell(row, col, value, filters):
+    # (row, col, ori_row, ori_col, value, ref_row, filters), see `read_cell`
+    return (row, col, row, col, value, 1, filters)
+
+
+class ApplyFiltersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = Recorder()
+        self.created = []
+
+    def create_filter(self, func, args):
+        self.created.append(func)
+        cls = {'batch': BatchFilter, 'cell': CellFilter}[func]
+        return cls(self.recorder, args)
+
+    def test_no_filters(self):
+        cells = [make_cell(1, 0, 'a', ()), make_cell(2, 0, 'b', ())]
+        self.assertEqual(apply_filters(None, 0, (), cells, self.create_filter), ['a', 'b'])
+        self.assertEqual(self.created, [])
+
+    def test_batch_and_cell(self):
+        filters = (('batch', ('x',)), ('cell', ()))
+        cells = [make_cell(row, 2, v, filters) for row, v in ((1, 'a'), (2, 'b'), (3, 'c'))]
+        values = apply_filters(None, 2, filters, cells, self.create_filter)
+
+        self.assertEqual(values, ['AX', 'BX', 'CX'])
+        # each filter is created once for the column
+        self.assertEqual(self.created, ['batch', 'cell'])
+        # the batch filter sees the whole column before the cell filter runs row by row
+        self.assertEqual(self.recorder.calls, [
+            ('batch', 2, (1, 2, 3)),
+            ('cell', 2, 1), ('cell', 2, 2), ('cell', 2, 3),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
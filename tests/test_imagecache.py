@@ -0,0 +1,109 @@
+# coding: utf-8
+
+"""
+    The converted image cache.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from xlreport.excel import imagecache
+from xlreport.excel.imagecache import ImageCache
+
+
+class FakeSheet(object):
+
+    def __init__(self):
+        self.images = []
+
+    def insert_bitmap_data(self, data, row, col):
+        self.images.append((data, row, col))
+
+
+class ImageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def files(self):
+        return sorted(os.listdir(self.tmpdir))
+
+    def test_lru(self):
+        cache = ImageCache(capacity=2)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, key * 3)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('c'), 'ccc')
+
+    def test_max_bytes(self):
+        cache = ImageCache(max_bytes=25)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, key * 10)
+        self.assertEqual(cache.entries.keys(), ['b', 'c'])
+        self.assertEqual(cache.size, 20)
+        # a hit moves the entry to the end without counting it twice
+        cache.get('b')
+        self.assertEqual(cache.entries.keys(), ['c', 'b'])
+        self.assertEqual(cache.size, 20)
+
+    def test_too_large(self):
+        cache = ImageCache(max_bytes=5)
+        cache.put('a', 'a' * 10)
+        self.assertEqual((len(cache.entries), cache.size), (0, 0))
+
+    def test_configure(self):
+        previous = imagecache.default_cache
+        try:
+            cache = imagecache.configure(cache_dir=self.tmpdir, max_bytes=100)
+            self.assertTrue(imagecache.default_cache is cache)
+            sheet = FakeSheet()
+            imagecache.insert_image(sheet, 'logo', 0, 0, (1, 1), lambda data, size: 'BM' + data)
+            self.assertEqual(cache.misses, 1)
+            self.assertEqual(len(self.files()), 1)
+        finally:
+            imagecache.default_cache = previous
+
+    def test_disk_tier(self):
+        ImageCache(cache_dir=self.tmpdir).put('a', 'aaa')
+        self.assertEqual(ImageCache(cache_dir=self.tmpdir).get('a'), 'aaa')
+
+    def test_disk_bound(self):
+        cache = ImageCache(cache_dir=self.tmpdir, max_disk_bytes=25)
+        for i, key in enumerate(('a', 'b', 'c')):
+            cache.put(key, key * 10)
+            # make the order of the mtimes certain
+            t = time.time() - 100 + i
+            os.utime(cache._path(key), (t, t))
+            cache._shrink_disk()
+        self.assertEqual(self.files(), ['b.bmp', 'c.bmp'])
+
+    def test_put_failure(self):
+        cache = ImageCache(cache_dir=self.tmpdir)
+        # not a byte string
+        self.assertRaises(TypeError, cache.put, 'a', object())
+        self.assertEqual(self.files(), [])
+
+    def test_insert_image(self):
+        cache = ImageCache()
+        calls = []
+
+        def convert(data, size):
+            calls.append(size)
+            return 'BM' + data
+
+        sheet = FakeSheet()
+        for row in (0, 5):
+            imagecache.insert_image(sheet, 'logo', row, 1, (10, 20), convert, cache)
+        self.assertEqual(calls, [(10, 20)])
+        self.assertEqual(sheet.images, [('BMlogo', 0, 1), ('BMlogo', 5, 1)])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
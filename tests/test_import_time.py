@@ -0,0 +1,62 @@
+# coding: utf-8
+
+"""
+    Import time budget of `xlreport.excel`.
+
+    Short-lived workers import the package for every job,
+    so the heavy dependencies must only be loaded when used.
+"""
+
+import os
+import sys
+import subprocess
+import unittest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# seconds, on top of the bare interpreter startup
+IMPORT_BUDGET = 0.3
+
+# modules which must not be loaded by the import alone
+HEAVY_MODULES = ('lxml', 'xlpy', 'multiprocessing')
+
+SCRIPT = '''
+import sys, time
+t = time.time()
+import xlreport.excel
+print(time.time() - t)
+print(','.join(m for m in %r if m in sys.modules))
+''' % (HEAVY_MODULES,)
+
+
+def run_import():
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.Popen([sys.executable, '-c', SCRIPT], cwd=ROOT, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    return proc.returncode, out.decode('utf8'), err.decode('utf8')
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    def setUp(self):
+        code, out, err = run_import()
+        if code != 0:
+            if 'ImportError' in err:
+                self.skipTest('xlreport.excel is not importable here: %s' % err.strip().splitlines()[-1])
+            self.fail(err)
+        elapsed, loaded = out.strip().split('\n')
+        self.elapsed = float(elapsed)
+        self.loaded = [m for m in loaded.split(',') if m]
+
+    def test_budget(self):
+        self.assertTrue(self.elapsed < IMPORT_BUDGET,
+                        'import xlreport.excel took %.3fs (budget %.3fs)' % (self.elapsed, IMPORT_BUDGET))
+
+    def test_no_heavy_modules(self):
+        self.assertEqual(self.loaded, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
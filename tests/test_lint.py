@@ -0,0 +1,94 @@
+# coding: utf-8
+
+"""
+    The template linter.
+"""
+
+import unittest
+
+from xlreport import stack_context
+from xlreport.excel.template import Template, GroupMacroDef, SheetMetaInfo, Macro, MacroDef, Extra
+from xlreport.excel.planner import SheetPlan, ReportPlan
+from xlreport.excel.lint import lint, get_sheet_costs, ERROR, WARNING
+
+
+def make_group(*cols):
+    """*cols* are macro strings, or tuples of a macro string and filter strings."""
+
+    macros = []
+    for col, x in enumerate(cols):
+        macrostr, filters = (x, ()) if isinstance(x, basestring) else (x[0], x[1:])
+        macros.append((col, Macro(macrostr), [Extra.parse(f) for f in filters]))
+    return GroupMacroDef(1, 3, None, macros)
+
+
+def make_template(group_macros=(), macros=(), sheet_name='report'):
+    meta = SheetMetaInfo()
+    meta.sheet_macro = Macro(sheet_name)
+    meta.group_macros = list(group_macros)
+    meta.macros = [MacroDef(0, col, Macro(m)) for col, m in enumerate(macros)]
+    template = Template(stack_context.create())
+    template.meta = {0: meta}
+    return template
+
+
+def find(diagnostics, kind):
+    return [d for d in diagnostics if d.kind == kind]
+
+
+class LintTest(unittest.TestCase):
+
+    def test_single_loop_deep_path(self):
+        template = make_template([make_group('#report/orders/order.id#', '#report/orders/order.name#')])
+        self.assertEqual(find(lint(template), 'deep-group'), [])
+
+    def test_sibling_levels_nest(self):
+        template = make_template([make_group('#a.x#', '#b.y#', '#c.z#')])
+        rslt = find(lint(template), 'deep-group')
+        self.assertEqual(len(rslt), 1)
+        self.assertEqual(rslt[0].severity, WARNING)
+        self.assertEqual(rslt[0].cost, 8)
+        self.assertTrue('nests 3 levels' in rslt[0].message)
+
+    def test_nested_levels(self):
+        group = make_group('#o.id#', '#o/l.sku#', '#o/l/p.name#')
+        rslt = find(lint(make_template([group])), 'deep-group')
+        self.assertEqual([d.cost for d in rslt], [8])
+
+    def test_group_filters(self):
+        group = make_group(('#o.id#', 'upper()', 'bold()'), '#o/l.sku#')
+        rslt = find(lint(make_template([group])), 'group-filters')
+        # 2 filters, 2 levels
+        self.assertEqual([d.cost for d in rslt], [4])
+
+    def test_group_filters_planned(self):
+        template = make_template([make_group(('#o.id#', 'upper()'))])
+        plan = ReportPlan()
+        for rows in (100, 50):
+            sheet = SheetPlan(0, 4)
+            sheet.group_rows = [rows]
+            plan.sheets.append(sheet)
+
+        rslt = find(lint(template, plan), 'group-filters')
+        self.assertEqual([d.cost for d in rslt], [150])
+        self.assertTrue('150 rows' in rslt[0].message)
+
+    def test_invalid_macros(self):
+        template = make_template(macros=['$company..name$', '$company.name$'])
+        rslt = find(lint(template), 'invalid-macro')
+        self.assertEqual([(d.severity, d.message) for d in rslt], [(ERROR, 'cell (0, 0)')])
+
+    def test_long_fallback(self):
+        template = make_template(macros=['$a.x | b.x | c.x | d.x$'])
+        rslt = find(lint(template), 'long-fallback')
+        self.assertEqual([d.cost for d in rslt], [4])
+
+    def test_order_and_costs(self):
+        template = make_template([make_group('#a.x#', '#b.y#', '#c.z#')], macros=['$a..x$'])
+        rslt = lint(template)
+        self.assertEqual(rslt[0].severity, ERROR)
+        self.assertEqual(get_sheet_costs(rslt), [(0, sum(d.cost for d in rslt))])
+
+
+if __name__ == '__main__':
+    unittest.main()
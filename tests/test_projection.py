@@ -0,0 +1,97 @@
+# coding: utf-8
+
+"""
+    Loading a data source through a `Projection`.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from lxml import etree
+    from xlreport.engine.xml_engine import XmlEngine
+except ImportError:
+    etree = None
+
+from xlreport.engine.projection import Projection
+
+
+DOC = '''<doc>
+  <company><name>ACME</name><address>Tokyo</address></company>
+  <items>
+    <item><name>a</name><price>1</price><history><entry>x</entry></history></item>
+    <item><name>b</name><price>2</price><history><entry>y</entry></history></item>
+  </items>
+  <log><line>unused</line></log>
+</doc>'''
+
+
+def make_projection():
+    rslt = Projection()
+    rslt.add('company', 'name')
+    rslt.add('items/item', 'name')
+    rslt.add('items/item', 'price')
+    return rslt
+
+
+class ProjectionTest(unittest.TestCase):
+
+    def test_wants(self):
+        projection = make_projection()
+        self.assertTrue(projection.wants(('items',)))
+        self.assertTrue(projection.wants(('items', 'item')))
+        self.assertTrue(projection.wants(('items', 'item', 'price')))
+        self.assertFalse(projection.wants(('items', 'item', 'history')))
+        self.assertFalse(projection.wants(('log',)))
+
+    def test_complex_path(self):
+        projection = make_projection()
+        projection.add('items/item[1]', 'name')
+        self.assertTrue(projection.keep_all)
+        self.assertTrue(projection.wants(('log',)))
+
+
+@unittest.skipIf(etree is None, 'lxml is not available')
+class XmlProjectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'doc.xml')
+        with open(self.path, 'w') as f:
+            f.write(DOC)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertPruned(self, root):
+        self.assertEqual(root.xpath('log'), [])
+        self.assertEqual(root.xpath('company/address'), [])
+        self.assertEqual(root.xpath('items/item/history'), [])
+        self.assertEqual(root.xpath('items/item/name/text()'), ['a', 'b'])
+        self.assertEqual(root.xpath('items/item/price/text()'), ['1', '2'])
+        self.assertEqual(root.xpath('company/name/text()'), ['ACME'])
+
+    def test_load(self):
+        self.assertPruned(XmlEngine.load(DOC, make_projection()))
+
+    def test_open(self):
+        source = XmlEngine.open(self.path, make_projection())
+        self.assertPruned(source.root)
+        items = source.xpath(-1, 'items/item')
+        self.assertEqual([source.get_child(x, 'price') for x in items], ['1', '2'])
+        source.close()
+
+    def test_no_projection(self):
+        source = XmlEngine.open(self.path)
+        self.assertEqual(source.root.xpath('log/line/text()'), ['unused'])
+
+    def test_keep_all(self):
+        projection = make_projection()
+        projection.add('//line', 'text')
+        self.assertEqual(XmlEngine.load(DOC, projection).xpath('log/line/text()'), ['unused'])
+
+
+if __name__ == '__main__':
+    unittest.main()
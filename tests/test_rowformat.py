@@ -0,0 +1,63 @@
+# coding: utf-8
+
+"""
+    Template row formats stamped onto generated rows.
+"""
+
+import unittest
+
+import xlwt
+
+from xlreport.excel.rowformat import RowFormats
+
+
+class RowFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workbook = xlwt.Workbook()
+        self.sheet = self.workbook.add_sheet('report', cell_overwrite_ok=True)
+        self.bold = xlwt.easyxf('font: bold on')
+        self.italic = xlwt.easyxf('font: italic on')
+        self.sheet.write(2, 1, 'name', self.bold)
+        self.sheet.write(2, 3, 0, self.italic)
+        ref = self.sheet.row(2)
+        ref.height = 600
+        ref.height_mismatch = 1
+        ref.level = 1
+        ref.hidden = 1
+        ref.set_style(self.bold)
+
+    def cells(self, rowx):
+        return sorted((col, cell.xf_idx) for col, cell in self.sheet.row(rowx)._Row__cells.iteritems())
+
+    def test_apply(self):
+        formats = RowFormats(self.sheet)
+        for rowx in (5, 6):
+            formats.get(2).apply(self.sheet.row(rowx))
+
+        for rowx in (5, 6):
+            row = self.sheet.row(rowx)
+            self.assertEqual(self.cells(rowx), self.cells(2))
+            self.assertEqual((row.height, row.height_mismatch), (600, 1))
+            self.assertEqual((row.level, row.hidden), (1, 1))
+            self.assertEqual(row._Row__xf_index, self.sheet.row(2)._Row__xf_index)
+        # still a valid workbook
+        self.workbook.get_biff_data()
+
+    def test_existing_cell(self):
+        self.sheet.write(5, 1, 'value')
+        RowFormats(self.sheet).get(2).apply(self.sheet.row(5))
+        cell = self.sheet.row(5)._Row__cells[1]
+        # the value is kept, the format is the template's
+        self.assertTrue(hasattr(cell, 'sst_idx'))
+        self.assertEqual(cell.xf_idx, dict(self.cells(2))[1])
+
+    def test_resolved_once(self):
+        formats = RowFormats(self.sheet)
+        self.assertTrue(formats.get(2) is formats.get(2))
+        formats.clear()
+        self.assertEqual(formats.formats, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# coding: utf-8
+
+"""
+    The stack based evaluation context.
+"""
+
+import unittest
+
+from lxml import etree
+
+from xlreport import stack_context
+from xlreport.engine.xml_engine import XmlSource
+
+
+DOC = '''<doc>
+  <company><name>ACME</name></company>
+  <orders>
+    <order><id>1</id><lines><line><sku>a</sku></line><line><sku>b</sku></line></lines></order>
+    <order><id>2</id><lines><line><sku>c</sku></line></lines></order>
+  </orders>
+</doc>'''
+
+
+class StackContextTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ctx = stack_context.create()
+        self.ctx.engine = XmlSource(etree.fromstring(DOC))
+        self.ctx.root = -1
+        self.orders = list(self.ctx.query('orders/order'))
+
+    def skus(self):
+        return [self.ctx.engine.get_child(x, 'sku') for x in self.ctx.query('orders/order/lines/line')]
+
+    def test_nested_scopes(self):
+        ctx = self.ctx
+        ctx.cache('orders/order', self.orders[0])
+        self.assertEqual(self.skus(), ['a', 'b'])
+
+        lines = list(ctx.query('orders/order/lines/line'))
+        ctx.cache('orders/order/lines/line', lines[1])
+        self.assertEqual(ctx.get('orders/order/lines/line', 'sku', False), 'b')
+        self.assertEqual(ctx.get('orders/order', 'id', False), '1')
+
+        ctx.clear_children('orders/order')
+        self.assertEqual(ctx.find('orders/order/lines/line', False), None)
+        self.assertEqual(ctx.get('orders/order', 'id', False), '1')
+
+    def test_sibling_reentry(self):
+        ctx = self.ctx
+        ctx.cache('orders/order', self.orders[0])
+        ctx.cache('orders/order/lines/line', list(ctx.query('orders/order/lines/line'))[0])
+
+        # entering the next order leaves the line of the previous one
+        ctx.cache('orders/order', self.orders[1])
+        self.assertEqual(ctx.get('orders/order', 'id', False), '2')
+        self.assertEqual(ctx.get('orders/order/lines/line', 'sku', False), '')
+        self.assertEqual(self.skus(), ['c'])
+
+    def test_search(self):
+        ctx = self.ctx
+        self.assertEqual(ctx.get('company', 'name', False), '')
+        self.assertEqual(ctx.get('company', 'name', True), 'ACME')
+        # found by the search above
+        self.assertEqual(ctx.get('company', 'name', False), 'ACME')
+
+    def test_search_scoped(self):
+        ctx = self.ctx
+        ctx.cache('orders/order', self.orders[0])
+        self.assertEqual(ctx.get('orders/order/lines/line', 'sku', True), 'a')
+        self.assertEqual(ctx.get('orders/order/lines/line', 'sku', False), 'a')
+
+        # the node found under the previous order is forgotten with it
+        ctx.cache('orders/order', self.orders[1])
+        self.assertEqual(ctx.get('orders/order/lines/line', 'sku', False), '')
+        self.assertEqual(ctx.get('orders/order/lines/line', 'sku', True), 'c')
+
+    def test_outer_search_kept(self):
+        ctx = self.ctx
+        self.assertEqual(ctx.get('company', 'name', True), 'ACME')
+        ctx.cache('orders/order', self.orders[0])
+        ctx.cache('orders/order', self.orders[1])
+        self.assertEqual(ctx.get('company', 'name', False), 'ACME')
+
+    def test_clear_cache(self):
+        ctx = self.ctx
+        ctx.cache('orders/order', self.orders[0])
+        ctx.get('company', 'name', True)
+        ctx.clear_cache()
+        self.assertEqual(ctx.find('orders/order', False), None)
+        self.assertEqual(ctx.get('company', 'name', False), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+# coding: utf-8
+
+"""
+    Evaluation of parsed templates against an XML data source.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from lxml import etree
+
+from xlreport import stack_context
+from xlreport.engine.xml_engine import XmlSource
+from xlreport.engine.projection import Projection
+from xlreport.excel.template import Template, GroupMacroDef, SheetMetaInfo, Macro, MacroDef, Path
+from xlreport.excel.template import TemplateError, open_source
+from xlreport.excel import template as template_module
+from xlreport.excel.planner import plan_report
+
+
+DOC = '''<doc>
+  <company><name>ACME</name></company>
+  <orders>
+    <order><id>1</id><lines><line><sku>a</sku></line><line><sku>b</sku></line></lines></order>
+    <order><id>2</id><lines><line><sku>c</sku></line></lines></order>
+    <order><id>3</id><lines/></order>
+  </orders>
+  <units><unit><name>kg</name></unit><unit><name>g</name></unit></units>
+</doc>'''
+
+
+def make_ctx(doc=DOC):
+    ctx = stack_context.create()
+    ctx.engine = XmlSource(etree.fromstring(doc))
+    ctx.root = -1
+    return ctx
+
+
+def make_group(*macrostrs):
+    return GroupMacroDef(1, 3, None, [(col, Macro(m), []) for col, m in enumerate(macrostrs)])
+
+
+def values(rows):
+    return [[value for col, (value, extras) in row] for row in rows]
+
+
+class InvariantTest(unittest.TestCase):
+
+    def test_invariant_levels(self):
+        gm = make_group('#orders/order.id#', '#units/unit.name#')
+        levels = [x for x in gm.level]
+        self.assertEqual([p for p, c in levels], ['orders/order', 'units/unit'])
+        self.assertEqual(gm.get_invariant_levels(levels), set([1]))
+
+    def test_nested_levels(self):
+        gm = make_group('#orders/order.id#', '#orders/order/lines/line.sku#')
+        self.assertEqual(gm.get_invariant_levels([x for x in gm.level]), set([]))
+
+    def test_memo_replay(self):
+        gm = make_group('#orders/order.id#', '#units/unit.name#')
+        levels = [x for x in gm.level]
+        invariant = gm.get_invariant_levels(levels)
+
+        serial = list(gm.iter(levels, make_ctx(), memo={}))
+        counters = {}
+        hoisted = list(gm.iter(levels, make_ctx(), counters=counters, invariant=invariant, memo={}))
+
+        self.assertEqual(hoisted, serial)
+        self.assertEqual(values(hoisted), [
+            ['1', 'kg'], ['', 'g'],
+            ['2', 'kg'], ['', 'g'],
+            ['3', 'kg'], ['', 'g'],
+        ])
+        # the units are evaluated for the first order only
+        self.assertEqual(counters, {'evaluated': 3 + 2, 'saved': 2 * 2})
+
+    def test_nested_rows(self):
+        gm = make_group('#orders/order.id#', '#orders/order/lines/line.sku#')
+        rows = list(gm.iter_data(make_ctx()))
+        self.assertEqual(values(rows), [['1', 'a'], ['', 'b'], ['2', 'c'], ['3', '']])
+
+    def test_invariant_macros(self):
+        meta = SheetMetaInfo()
+        meta.macros = [
+            MacroDef(0, 0, Macro('$company.name$')),
+            MacroDef(0, 1, Macro('$orders/order.id$')),
+        ]
+        template = Template(make_ctx())
+        rslt = template.get_invariant_macros(meta, 'orders/order')
+        self.assertEqual(rslt, {meta.macros[0].macro: 'ACME'})
+        self.assertEqual(template.counters['evaluated'], 1)
+
+
+class ValidateTest(unittest.TestCase):
+
+    def test_path(self):
+        self.assertTrue(Path(Path.MODE_PLAIN, 'company.name').validate())
+        self.assertTrue(Path(Path.MODE_PLAIN, 'a.x | b/c.y | literal').validate())
+        self.assertTrue(Path(Path.MODE_PLAIN, 'item.@id').validate())
+        self.assertFalse(Path(Path.MODE_PLAIN, 'company..name').validate())
+        self.assertFalse(Path(Path.MODE_PLAIN, 'company.').validate())
+        self.assertFalse(Path(Path.MODE_PLAIN, 'a.x | ').validate())
+
+    def test_macro(self):
+        self.assertTrue(Macro('$company.name$ #orders/order.id#').validate())
+        self.assertTrue(Macro('no macro').validate())
+        self.assertFalse(Macro('$company..name$').validate())
+        # at most one group path per cell
+        self.assertFalse(Macro('#a.x# #b.y#').validate())
+
+
+def make_orders_doc(n):
+    orders = []
+    for i in xrange(n):
+        lines = ''.join('<line><sku>%s-%s</sku></line>' % (i, j) for j in xrange(i % 3))
+        orders.append('<order><id>%s</id><lines>%s</lines></order>' % (i, lines))
+    return '<doc><orders>%s</orders></doc>' % ''.join(orders)
+
+
+def count_queries(ctx):
+    calls = []
+    query = ctx.query
+
+    def counting_query(prefix):
+        calls.append(prefix)
+        return query(prefix)
+
+    ctx.query = counting_query
+    return calls
+
+
+class NoFork(object):
+    """Stands for the `os` module of a platform without fork."""
+
+
+class ShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = make_orders_doc(40)
+        self.gm = make_group('#orders/order.id#', '#orders/order/lines/line.sku#')
+        self.gm.SHARD_MIN_ROWS = 10
+
+    @unittest.skipIf(not hasattr(os, 'fork'), 'fork is not available')
+    def test_same_rows(self):
+        serial = list(self.gm.iter_data(make_ctx(self.doc)))
+
+        sharded_calls = []
+        iter_sharded = self.gm.iter_sharded
+
+        def recording_iter_sharded(*args):
+            sharded_calls.append(len(args[1]))
+            return iter_sharded(*args)
+
+        self.gm.iter_sharded = recording_iter_sharded
+        sharded = list(self.gm.iter_data(make_ctx(self.doc), workers=2))
+
+        self.assertEqual(sharded_calls, [40])
+        # same rows in the same order, so `#no#` and the ref rows are the same too
+        self.assertEqual(sharded, serial)
+        self.assertEqual(len(serial), sum(max(1, i % 3) for i in xrange(40)))
+
+    def test_small_group_queried_once(self):
+        self.gm.SHARD_MIN_ROWS = 1000
+        ctx = make_ctx(self.doc)
+        calls = count_queries(ctx)
+        rows = list(self.gm.iter_data(ctx, workers=2))
+        self.assertEqual(calls.count('orders/order'), 1)
+        self.assertEqual(rows, list(self.gm.iter_data(make_ctx(self.doc))))
+
+    def test_no_fork(self):
+        ctx = make_ctx(self.doc)
+        calls = count_queries(ctx)
+        saved = template_module.os
+        template_module.os = NoFork()
+        try:
+            rows = list(self.gm.iter_data(ctx, workers=2))
+        finally:
+            template_module.os = saved
+        self.assertEqual(rows, list(self.gm.iter_data(make_ctx(self.doc))))
+        self.assertEqual(calls.count('orders/order'), 1)
+
+
+class LoadOnlyEngine(object):
+    """An engine predating `open`."""
+
+    @staticmethod
+    def load(doc):
+        return 'loaded %s' % doc
+
+
+class SourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'doc.xml')
+        with open(self.path, 'w') as f:
+            f.write(DOC)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_xml_path(self):
+        source = open_source('xml', self.path)
+        self.assertEqual([source.get_child(x, 'id') for x in source.xpath(-1, 'orders/order')], ['1', '2', '3'])
+        source.close()
+
+    def test_xml_projection(self):
+        projection = Projection()
+        projection.add('orders/order', 'id')
+        source = open_source('xml', self.path, projection)
+        self.assertEqual(source.xpath(-1, 'units'), [])
+        self.assertEqual(len(source.xpath(-1, 'orders/order')), 3)
+
+    def test_load_only(self):
+        self.assertEqual(open_source(LoadOnlyEngine, 'x'), 'loaded x')
+        self.assertRaises(TemplateError, open_source, LoadOnlyEngine, 'x', Projection())
+
+    def test_plan_xml(self):
+        meta = SheetMetaInfo()
+        meta.sheet_macro = Macro('report')
+        meta.nrows = 4
+        meta.group_macros = [make_group('#orders/order.id#', '#orders/order/lines/line.sku#')]
+        template = Template(stack_context.create())
+        template.meta = {0: meta}
+
+        plan = plan_report(template, self.path, 'xml')
+        self.assertEqual([s.group_rows for s in plan.sheets], [[4]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# coding: utf-8
+
+"""
+    Output helpers of `xlreport.util`.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from xlreport.util import zipfile, AtomicFile, StreamWriter
+
+
+class AtomicFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'report.xls')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_commit(self):
+        with open(self.path, 'wb') as f:
+            f.write('previous')
+        out = AtomicFile(self.path)
+        out.write('new')
+        # the previous report stays in place until complete
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), 'previous')
+        out.commit()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(os.listdir(self.tmpdir), ['report.xls'])
+
+    def test_discard(self):
+        out = AtomicFile(self.path)
+        out.write('partial')
+        out.discard()
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_zip(self):
+        out = AtomicFile(self.path)
+        zf = zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED)
+        zf.writestr('a.xls', 'data')
+        zf.close()
+        out.commit()
+        self.assertEqual(zipfile.ZipFile(self.path).read('a.xls'), 'data')
+
+
+class StreamWriterTest(unittest.TestCase):
+
+    def test_callback(self):
+        chunks = []
+        out = StreamWriter(chunks.append)
+        out.write('ab')
+        out.write('')
+        out.write('c')
+        self.assertEqual(chunks, ['ab', 'c'])
+        self.assertEqual(out.tell(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,10 +5,100 @@
     ~~~~~~~~~~~~~~~
 
     Data source engines.
+
+    Engines are registered by name and imported on first use,
+    so that e.g. lxml is only loaded when the xml engine is really used.
+    Third-party engines are found through the ``xlreport.engines`` entry points::
+
+        entry_points={'xlreport.engines': ['csv = mypackage.csv_engine:CsvEngine']}
+
+    `XmlEngine`, `JsonEngine` and `JsonDBEngine` are `LazyEngine` placeholders, not classes.
+    Subclass or type check against the class itself instead::
+
+        class MyEngine(get_engine('xml')):
+            ...
 """
 
 
-from xml_engine import XmlEngine
-from json_engine import JsonEngine
-from jsondb_engine import JsonDBEngine
+ENTRY_POINT_GROUP = 'xlreport.engines'
+
+_registry = {
+    'xml':      'xlreport.engine.xml_engine:XmlEngine',
+    'json':     'xlreport.engine.json_engine:JsonEngine',
+    'jsondb':   'xlreport.engine.jsondb_engine:JsonDBEngine',
+}
+
+_loaded = {}
+
+
+def register_engine(name, engine):
+    """Register *engine* as *name*.
+
+    *engine* is either an engine class or a ``'module:attr'`` string,
+    the latter is imported the first time the engine is used.
+    """
+    _registry[name] = engine
+    _loaded.pop(name, None)
+
+
+def _import(spec):
+    modname, attr = spec.split(':')
+    module = __import__(modname, fromlist=[attr])
+    return getattr(module, attr)
+
+
+def _find_entry_point(name):
+    import pkg_resources
+    for ep in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP, name):
+        return ep.load()
+    return None
+
+
+def get_engine(name):
+    """Returns the engine class registered as *name*.
+
+    A `LazyEngine` is resolved to its class, engine classes are returned as they are.
+    """
+    if isinstance(name, LazyEngine):
+        name = name.name
+    if not isinstance(name, basestring):
+        return name
+    if name in _loaded:
+        return _loaded[name]
+
+    engine = _registry.get(name)
+    if engine is None:
+        engine = _find_entry_point(name)
+        if engine is None:
+            raise KeyError('unknown engine: %s' % name)
+    elif isinstance(engine, basestring):
+        engine = _import(engine)
+    _loaded[name] = engine
+    return engine
+
+
+class LazyEngine(object):
+    """Stands for a registered engine, importing it on the first attribute access.
+
+    Every attribute access goes through the registry,
+    so resolve it once with `get_engine` before using it in a loop.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_engine(self.name), attr)
+
+    def __repr__(self):
+        return '<LazyEngine> %s' % self.name
+
+
+XmlEngine = LazyEngine('xml')
+JsonEngine = LazyEngine('json')
+JsonDBEngine = LazyEngine('jsondb')
 
+__all__ = [
+    'XmlEngine', 'JsonEngine', 'JsonDBEngine',
+    'LazyEngine', 'get_engine', 'register_engine',
+]
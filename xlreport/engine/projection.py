@@ -0,0 +1,57 @@
+# coding: utf-8
+
+"""
+    xlreport.engine.projection
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    The set of data pathes a template reads.
+
+    Engines use it to skip the subtrees no macro refers to while loading.
+    Only `XmlEngine.open` supports it so far, JSON sources are always loaded whole.
+"""
+
+import re
+
+
+# Pathes using anything beyond plain child steps can't be projected.
+REGEX_COMPLEX = re.compile(r'[\[\]()*:]|//|\.\.|^/')
+
+
+class Projection(object):
+    """Referenced pathes, as tuples of tags from the root node.
+
+    * *nodes* :     path -> set of properties read from the node.
+    * *keep_all* :  True if some path is too complex to analyze,
+                    in which case nothing is pruned.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.ancestors = set([])
+        self.keep_all = False
+
+    def add(self, path, prop):
+        """Register the property *prop* of the node at *path* as referenced."""
+
+        if REGEX_COMPLEX.search(path) or REGEX_COMPLEX.search(prop):
+            self.keep_all = True
+            return
+
+        parts = tuple(x for x in path.split('/') if x)
+        self.nodes.setdefault(parts, set([])).add(prop)
+        for i in xrange(len(parts)):
+            self.ancestors.add(parts[:i])
+
+    def wants(self, parts):
+        """Returns True if the node at *parts* must be loaded."""
+
+        if self.keep_all:
+            return True
+        if parts in self.nodes or parts in self.ancestors:
+            return True
+        # a child element read as a property
+        return len(parts) > 0 and parts[-1] in self.nodes.get(parts[:-1], ())
+
+    def __repr__(self):
+        return '<Projection> %s' % ('*' if self.keep_all else len(self.nodes))
+
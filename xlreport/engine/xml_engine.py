@@ -13,12 +13,98 @@ from lxml import etree
 from xlreport.engine.base import BaseEngine
 
 
+class ProjectingTarget(object):
+    """Parser target building only the elements wanted by a `Projection`.
+
+    The events inside an unwanted element are dropped as they come,
+    so the subtree is never built.
+    """
+
+    def __init__(self, projection):
+        self.projection = projection
+        self.builder = etree.TreeBuilder()
+        self.parts = []
+        self.depth = 0
+        # depth inside the unwanted element being skipped
+        self.skip = 0
+
+    def start(self, tag, attrib, nsmap=None):
+        if self.skip > 0:
+            self.skip += 1
+            return
+        # the root element is not part of the pathes
+        if self.depth > 0:
+            self.parts.append(tag)
+            if not self.projection.wants(tuple(self.parts)):
+                self.parts.pop()
+                self.skip = 1
+                return
+        self.depth += 1
+        self.builder.start(tag, attrib, nsmap)
+
+    def end(self, tag):
+        if self.skip > 0:
+            self.skip -= 1
+            return
+        self.depth -= 1
+        if self.depth > 0:
+            self.parts.pop()
+        return self.builder.end(tag)
+
+    def data(self, data):
+        if self.skip == 0:
+            self.builder.data(data)
+
+    def close(self):
+        return self.builder.close()
+
+
+class XmlSource(object):
+    """An opened XML data source, see `XmlEngine.open`.
+
+    Pathes are evaluated from the root element when the node is -1.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def xpath(self, node, path):
+        if node == -1:
+            node = self.root
+        return node.xpath(path)
+
+    def get_child(self, node, tag):
+        return XmlEngine.get_child(node, tag)
+
+    def close(self):
+        self.root = None
+
+
 class XmlEngine(BaseEngine):
     """Xmlエンジン"""
 
     @staticmethod
-    def load(s):
-        return etree.fromstring(s)
+    def load(s, projection=None):
+        """Parse *s*.
+
+        When *projection* (see `xlreport.engine.projection`) is specified,
+        the elements it doesn't want are dropped while parsing.
+        """
+
+        if projection is None or projection.keep_all:
+            return etree.fromstring(s)
+        return etree.fromstring(s, etree.XMLParser(target=ProjectingTarget(projection)))
+
+    @staticmethod
+    def open(path, projection=None):
+        """Load the XML file at *path* as the data source of `Template.apply`.
+
+        Only the elements wanted by *projection* are loaded, see `load`.
+        """
+
+        if projection is None or projection.keep_all:
+            return XmlSource(etree.parse(path).getroot())
+        return XmlSource(etree.parse(path, etree.XMLParser(target=ProjectingTarget(projection))))
 
     @staticmethod
     def dump(node, **kws):
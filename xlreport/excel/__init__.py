@@ -10,18 +10,21 @@
 import math
 import time
 import os
-import tempfile
-import shutil
-from lxml import etree
-import xlpy
+from cStringIO import StringIO
+from collections import OrderedDict
 
-from xlreport.engine import XmlEngine, JsonEngine
-from xlreport.util import zipfile
+from xlreport.engine import XmlEngine, JsonEngine, JsonDBEngine, get_engine
+from xlreport.util import zipfile, StreamWriter, AtomicFile, LazyAttr
 from xlreport.util import ensure_unicode as uni
 
 from template import Template
-from image import Image
-from filter import create_filter
+from prepared import PreparedTemplate
+from planner import plan_report
+from cow import copy_sheet_cow
+from rowformat import RowFormats
+
+# `image` is only imported when an Image is actually used
+Image = LazyAttr('xlreport.excel.image', 'Image')
 
 import logging, traceback
 logger = logging.getLogger(__file__)
@@ -62,139 +65,234 @@ class BookInfo(object):
         return self.names.get(idx) or default
 
 
-def generate_report(src_doc, template_path, dest_path, split=False, engine=XmlEngine):
+def generate_report(src_doc, template_path, dest_path, split=False, engine=XmlEngine,
+                    split_only=False, project=False, workers=0, cow=False, source=JsonDBEngine):
     """Generate excel file.
 
     * *src_doc*:        Data source path
-    * *template_path*:  Template file path
-    * *dest_path*:      Destination file path
+    * *template_path*:  Template file path, or a `PreparedTemplate`
+    * *dest_path*:      Destination file path, a writable file-like object,
+                        or a callable receiving the output bytes chunk by chunk.
     * *split*:          When set to True, sheets will be splitted into seperate workbooks and compressed into a single zip file.
+                        Each sheet is added to the zip as soon as it's generated.
     * *engine*          Data source engine. See `xlreport.engine`
+    * *split_only*:     Implies *split*. Each sheet is rendered directly into its own workbook,
+                        the combined workbook is never built.
+    * *project*:        When set to True, the data source is loaded without the subtrees
+                        the template never refers to. Only the xml *source* supports it so far.
+    * *workers*:        When greater than 1, large groups are evaluated in this many processes.
+    * *cow*:            When set to True, sheets of multiple sheet templates share the rows
+                        of their reference sheet until written. See `xlreport.excel.cow`
+                        Can not be used with *split*.
+    * *source*:         Engine loading *src_doc*. See `Template.apply`
 
     Yields the worksheet's name each time a new worksheet generated.
     """
 
-    w = xlpy.create_copy(template_path)
+    import xlpy
+
+    # resolved once, rather than through `LazyEngine` on every cell
+    engine = get_engine(engine)
+    split = split or split_only
+    if cow and split:
+        # the split sheets are copied to other workbooks along with the rows they share
+        raise ValueError('cow can not be used with split')
+
+    if isinstance(template_path, PreparedTemplate):
+        # In split_only mode the template workbook is only copied from, no need for a copy
+        w = template_path.workbook if split_only else template_path.new_workbook()
+        template = template_path.template
+    else:
+        w = xlpy.create_copy(template_path)
+        template = Template.parse(template_path)
     info = BookInfo()
-    template = Template.parse(template_path)
+    projection = template.get_projection() if project else None
+    template.shard_workers = workers
 
-    if split:
-        tmpdir = tempfile.mkdtemp()
-        # TODO: total count is available later
-        #total_cnt = w.get_sheet_count()
-        #digits = int(math.log10(total_cnt)) + 1
-        digits = 4
-        fmt = "%%0%sd" % digits
+    if isinstance(dest_path, basestring):
+        # renamed to dest_path once complete, so a failure leaves no partial report behind
+        out = AtomicFile(dest_path)
+    else:
+        out = StreamWriter(dest_path)
 
     try:
-        for idx, node_sheet in enumerate(template.apply(src_doc, engine=engine)):
+        if split:
+            # TODO: total count is available later
+            #total_cnt = w.get_sheet_count()
+            #digits = int(math.log10(total_cnt)) + 1
+            digits = 4
+            fmt = "%%0%sd" % digits
+            rslt = zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED)
+
+        for idx, node_sheet in enumerate(template.apply(src_doc, engine=engine, projection=projection,
+                                                                    source=source)):
             nodesheet = node_sheet['Sheet']
             sheet_name = engine.get_child(nodesheet, 'name')
             sheet_name = info.register_name(idx, sheet_name)
-            sheet = generate_sheet(w, nodesheet, sheet_name, engine=engine)
+
+            if split_only:
+                # Hidden sheets are not exported, so don't bother rendering them
+                if '$' not in sheet_name:
+                    wb = xlpy.Workbook()
+                    sheet = generate_sheet(wb, nodesheet, sheet_name, engine=engine, source=w)
+                    page_setup_default(idx, sheet)
+                    if sheet.is_visible():
+                        write_zip_entry(rslt, u'%s_%s.xls' % (fmt % idx, uni(sheet.name)), wb)
+                    sheet = None
+                    wb = None
+                del nodesheet
+                yield sheet_name
+                continue
+
+            sheet = generate_sheet(w, nodesheet, sheet_name, engine=engine, cow=cow)
             del nodesheet
             page_setup_default(idx, sheet)
 
             if split and sheet.is_visible():
                 wb = xlpy.Workbook()
                 wb.copy_sheet_from_book(w, sheet.index, sheet.name)
-                path = os.path.join(tmpdir, u'%s_%s.xls' % (fmt % idx, uni(sheet.name)))
-                wb.save(path.encode('utf8'))
+                write_zip_entry(rslt, u'%s_%s.xls' % (fmt % idx, uni(sheet.name)), wb)
                 wb = None
  
             sheet.flush_row_data()
             sheet = None
 
             yield sheet_name
+
+        if split:
+            # The combined workbook is not part of the zip
+            rslt.close()
+        else:
+            for idx, sheet in enumerate(w.get_original_sheets()):
+                page_setup_default(idx, sheet)
+            w.save(out)
+        w = None
     except:
         logger.error('error occured during excel generation')
+        if isinstance(out, AtomicFile):
+            out.discard()
         raise
     finally:
         del info
         del template
 
-    for idx, sheet in enumerate(w.get_original_sheets()):
-        page_setup_default(idx, sheet)
+    if isinstance(out, AtomicFile):
+        out.commit()
+    else:
+        out.flush()
+
 
-    w.save(dest_path)
-    w = None
+def write_zip_entry(zf, name, workbook):
+    """Save *workbook* as the entry *name* of the zip file *zf*."""
 
-    if split:
-        # split the sheets and zip all
-        fd, tmppath = tempfile.mkstemp(suffix='.zip')
-        rslt = zipfile.ZipFile(os.fdopen(fd, 'wb'), 'w', zipfile.ZIP_DEFLATED)
-        for r, dirs, files in os.walk(tmpdir):
-            for fpath in files:
-                if isinstance(fpath, str):
-                    fpath = unicode(fpath, 'utf8')
-                rslt.write(os.path.join(r, fpath.encode('utf8')), arcname=fpath.encode('cp932'))
-        rslt.close()
-        shutil.copy2(tmppath, dest_path)
+    buf = StringIO()
+    workbook.save(buf)
+    info = zipfile.ZipInfo(name.encode('cp932'), time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0644 << 16L
+    zf.writestr(info, buf.getvalue())
+    buf.close()
 
 
-def generate_sheet(workbook, nodesheet, sheet_name, engine=XmlEngine):
+def generate_sheet(workbook, nodesheet, sheet_name, engine=XmlEngine, source=None, cow=False):
     """Make excel worksheet.
 
     * *workbook*        Workbook to append sheet to
     * *nodesheet*       Data
     * *sheet_name*      Sheet's name
     * *engine*          Data engine to use. See `xlreport.engine`
+    * *source*          When specified, the reference sheet is copied from this template workbook
+                        into the empty *workbook* instead of being taken from *workbook* itself.
+    * *cow*             Clone the reference sheet copy-on-write. See `xlreport.excel.cow`
 
     """
 
     w = workbook
+    engine = get_engine(engine)
 
     start = time.time()
 
     is_multiple = engine.get_child(nodesheet, 'multiple') == 'True'
     ref_sheet_id = int(engine.get_child(nodesheet, 'copy_from'))
 
-    if is_multiple:
+    if source is not None:
+        w.copy_sheet_from_book(source, ref_sheet_id, sheet_name)
+        # the only sheet in the book
+        sheet = w.get_sheet(0)
+    elif is_multiple and cow:
+        sheet = copy_sheet_cow(w, ref_sheet_id, sheet_name)
+    elif is_multiple:
         sheet = w.copy_sheet(ref_sheet_id, sheet_name)
     else:
         sheet = w.get_combined_sheet(ref_sheet_id)
         sheet.name = sheet_name
 
-    nodeprior = engine.find(nodesheet, 'Priors')
-    for node in engine.findall(nodeprior, 'clear_cell'):
-        row = int(engine.get_child(node, 'row'))
-        col = int(engine.get_child(node, 'col'))
-        sheet.set_value(row, col, '')
-
-    insert_rows = []
-    for node in engine.findall(nodeprior, 'insert_rows'):
-        before = int(engine.get_child(node, 'before'))
-        count = int(engine.get_child(node, 'count'))
-        ref_row = int(engine.get_child(node, 'copy_from'))
-        insert_rows.append((before, count, ref_row))
-
-    # Insert rows from bottom to top, so we won't mess up the sheet
-    insert_rows.sort(key=(lambda (b,c,r): b*-1))
-
-    for before, count, ref_row in insert_rows:
-        print before, count, ref_row
-        if count > 0:
-            sheet.insert_row_before(before, count)
-        for i in xrange(count):
+    formats = RowFormats(sheet)
+
+    # Static sheets have no priors, their cells are simply written in place.
+    is_static = engine.get_child(nodesheet, 'static') == 'True'
+    if not is_static:
+        nodeprior = engine.find(nodesheet, 'Priors')
+        for node in engine.findall(nodeprior, 'clear_cell'):
+            row = int(engine.get_child(node, 'row'))
+            col = int(engine.get_child(node, 'col'))
+            sheet.set_value(row, col, '')
+
+        insert_rows = []
+        for node in engine.findall(nodeprior, 'insert_rows'):
+            before = int(engine.get_child(node, 'before'))
+            count = int(engine.get_child(node, 'count'))
+            ref_row = int(engine.get_child(node, 'copy_from'))
+            insert_rows.append((before, count, ref_row))
+
+        # Insert rows from bottom to top, so we won't mess up the sheet
+        insert_rows.sort(key=(lambda (b,c,r): b*-1))
+
+        for before, count, ref_row in insert_rows:
+            print before, count, ref_row
+            if count > 0:
+                sheet.insert_row_before(before, count)
+                # the template rows below have moved
+                formats.clear()
             #sheet.insert_row_before(before)
-            cols = [(0, '')]
-            sheet.write_row(before + i, ref_row, *cols)
+            write_rows(sheet, ref_row, [(before + i, [(0, '')]) for i in xrange(count)], formats)
 
     nodecells = engine.find(nodesheet, 'Cells')
     if nodecells is not None:
+        from filter import create_filter
+
         data = {}
+        columns = OrderedDict()
         for nodecell in engine.findall(nodecells, 'Cell'):
-            row = int(engine.get_child(nodecell, 'row'))
-            col = int(engine.get_child(nodecell, 'col'))
-            ref_row, value = write_cell(sheet, nodecell, engine)
-            if ref_row == -1:
+            cell = read_cell(nodecell, engine)
+            if cell[5] == -1:
+                write_cell(sheet, nodecell, engine, cell, create_filter)
                 continue
-            if row not in data:
-                data[row] = [ref_row, []]
-            data[row][1].append([col, value])
-
+            # Cells of a group column share their filters,
+            # so filters are applied to the whole column at once.
+            # Columns are filtered in the order their first cell comes.
+            col, filters = cell[1], cell[6]
+            if (col, filters) not in columns:
+                columns[(col, filters)] = []
+            columns[(col, filters)].append(cell)
+
+        for (col, filters), cells in columns.iteritems():
+            values = apply_filters(sheet, col, filters, cells, create_filter)
+            for (row, col, ori_row, ori_col, v, ref_row, fs), value in zip(cells, values):
+                if row not in data:
+                    data[row] = [ref_row, []]
+                data[row][1].append([col, value])
+
+        # A group refers to at most two template rows,
+        # so the rows are written in runs sharing the same reference row.
+        runs = {}
         for row, (ref_row, cols) in data.items():
-            sheet.write_row(row, ref_row, *cols)
+            if ref_row not in runs:
+                runs[ref_row] = []
+            runs[ref_row].append((row, cols))
+        for ref_row, rows in runs.iteritems():
+            rows.sort()
+            write_rows(sheet, ref_row, rows, formats)
             #sheet.flush_row_data()
 
     end = time.time()
@@ -202,14 +300,37 @@ def generate_sheet(workbook, nodesheet, sheet_name, engine=XmlEngine):
     return sheet
 
 
-def write_cell(sheet, nodecell, engine):
-    """Write data to a cell.
+def write_rows(sheet, ref_row, rows, formats=None):
+    """Write *rows* formatted after the same template row.
 
     * *sheet*       Worksheet object. See `xlpy.xlwt.worksheet.Worksheet`
+    * *ref_row*     Template row to copy the formatting from.
+    * *rows*        List of (rowno, cols).
+    * *formats*     `RowFormats` of the sheet. The formatting of *ref_row* is taken from it,
+                    so it's resolved only once per sheet.
+
+    Falls back to ``write_row`` for each row when *formats* can't be used.
+    """
+
+    fmt = formats.get(ref_row) if formats is not None and len(rows) > 0 else None
+    if fmt is None:
+        for row, cols in rows:
+            sheet.write_row(row, ref_row, *cols)
+        return
+    for row, cols in rows:
+        fmt.apply(sheet.row(row))
+        for col, value in cols:
+            sheet.set_value(row, col, value)
+
+
+def read_cell(nodecell, engine):
+    """Read cell data.
+
     * *nodecell*    Cell data.
     * *engine*      Data source engine. See `xlreport.engine`
 
-    Returns a tuple of (ref_rowno, value).
+    Returns a tuple of (row, col, ori_row, ori_col, value, ref_row, filters),
+    where *filters* is a tuple of (funcname, args).
     """
 
     row     = int(engine.get_child(nodecell, 'row'))
@@ -226,11 +347,70 @@ def write_cell(sheet, nodecell, engine):
             func = engine.get_child(extra, 'func')
             argn = engine.get_child(extra, 'argn') or 0
             args = [engine.get_child(extra, 'arg%s' % i) or '' for i in range(int(argn))] or []
-            args = [x.strip() for x in args]
-            filters.append(create_filter(func, args))
+            args = tuple(x.strip() for x in args)
+            filters.append((func, args))
+
+    return row, col, ori_row, ori_col, value, ref_row, tuple(filters)
+
+
+def apply_filters(sheet, col, filters, cells, create_filter=None):
+    """Apply *filters* to the *cells* of the column *col*.
+
+    * *sheet*           Worksheet object. See `xlpy.xlwt.worksheet.Worksheet`
+    * *col*             Column the *cells* are in.
+    * *filters*         Tuple of (funcname, args).
+    * *cells*           List of cell tuples. See `read_cell`
+    * *create_filter*   `filter.create_filter`, imported here when not given.
+
+    A filter may implement
+    ``apply_batch(sheet, col, values, rows, ref_rows, ori_rows, ori_cols)``
+    returning the list of filtered values,
+    otherwise its ``apply`` is called for each cell.
+
+    NOTE: filters run column by column, each one over the whole column,
+          not row by row as when every cell was written on its own.
+          A filter writing to *sheet* (e.g. an image) must not rely on
+          the other columns of the same row being done yet.
+
+    Returns the list of filtered values.
+    """
+
+    values = [cell[4] for cell in cells]
+    if len(filters) == 0:
+        return values
+
+    if create_filter is None:
+        from filter import create_filter
+
+    rows, cols, ori_rows, ori_cols, vs, ref_rows, fs = zip(*cells)
+    for func, args in filters:
+        filter = create_filter(func, list(args))
+        if hasattr(filter, 'apply_batch'):
+            values = list(filter.apply_batch(sheet, col, values, rows, ref_rows, ori_rows, ori_cols))
+            continue
+        values = [filter.apply(sheet, row, col, value, ref_row, ori_row, ori_col)
+                  for row, value, ref_row, ori_row, ori_col
+                  in zip(rows, values, ref_rows, ori_rows, ori_cols)]
+    return values
+
+
+def write_cell(sheet, nodecell, engine, cell=None, create_filter=None):
+    """Write data to a cell.
+
+    * *sheet*           Worksheet object. See `xlpy.xlwt.worksheet.Worksheet`
+    * *nodecell*        Cell data.
+    * *engine*          Data source engine. See `xlreport.engine`
+    * *cell*            Cell tuple already read from *nodecell*. See `read_cell`
+    * *create_filter*   See `apply_filters`
+
+    Returns a tuple of (ref_rowno, value).
+    """
+
+    if cell is None:
+        cell = read_cell(nodecell, engine)
+    row, col, ori_row, ori_col, value, ref_row, filters = cell
 
-    for filter in filters:
-        value = filter.apply(sheet, row, col, value, ref_row, ori_row, ori_col)
+    value = apply_filters(sheet, col, filters, [cell], create_filter)[0]
 
     if ref_row == -1:
         sheet.set_value(row, col, value)
@@ -0,0 +1,147 @@
+# coding: utf-8
+
+"""
+    xlreport.excel.cow
+    ~~~~~~~~~~~~~~~~~~
+
+    Copy-on-write cloning of worksheets.
+
+    A cloned sheet shares the row records of its reference sheet.
+    A row is copied only right before it's written or shifted,
+    so the untouched rows of a heavily formatted template cost nothing per clone.
+
+    The shared rows still belong to the reference sheet, so a clone must not be
+    copied to another workbook (as the split mode of `generate_report` does).
+"""
+
+import copy
+
+
+# Row records of a `xlpy.xlwt.worksheet.Worksheet`
+ROWS_ATTR = '_Worksheet__rows'
+
+# Sheet and workbook a `xlpy.xlwt.Row.Row` belongs to
+PARENT_ATTR = '_Row__parent'
+PARENT_WB_ATTR = '_Row__parent_wb'
+
+
+def copy_sheet_cow(workbook, ref_sheet_id, sheet_name):
+    """Same as ``workbook.copy_sheet(ref_sheet_id, sheet_name)``,
+    but the rows are shared with the reference sheet until written.
+
+    Falls back to a plain copy when the worksheet doesn't keep its rows where we expect.
+    """
+
+    ref = workbook.get_sheet(ref_sheet_id)
+    rows = getattr(ref, ROWS_ATTR, None)
+    if not isinstance(rows, dict):
+        return workbook.copy_sheet(ref_sheet_id, sheet_name)
+
+    # Copy everything but the rows
+    setattr(ref, ROWS_ATTR, {})
+    try:
+        sheet = workbook.copy_sheet(ref_sheet_id, sheet_name)
+    finally:
+        setattr(ref, ROWS_ATTR, rows)
+
+    setattr(sheet, ROWS_ATTR, dict(rows))
+    sheet.cow_shared = set(rows)
+    sheet.__class__ = cow_class(type(sheet))
+    return sheet
+
+
+def materialize(sheet, *indices):
+    """Give *sheet* its own copy of the rows at *indices*."""
+
+    rows = getattr(sheet, ROWS_ATTR)
+    for indx in indices:
+        if indx not in sheet.cow_shared:
+            continue
+        sheet.cow_shared.discard(indx)
+        row = rows.get(indx)
+        if row is None:
+            continue
+        # the shared row belongs to the reference sheet, the copy to this one
+        memo = {
+            id(getattr(row, PARENT_ATTR)):      sheet,
+            id(getattr(row, PARENT_WB_ATTR)):   sheet.get_parent(),
+        }
+        rows[indx] = copy.deepcopy(row, memo)
+
+
+def _row(method):
+    def row(self, indx):
+        materialize(self, indx)
+        return method(self, indx)
+    return row
+
+
+def _write(method):
+    def write(self, r, c, *args, **kws):
+        materialize(self, r)
+        return method(self, r, c, *args, **kws)
+    return write
+
+
+def _merge(method):
+    def merge(self, r1, r2, *args, **kws):
+        materialize(self, *xrange(r1, r2 + 1))
+        return method(self, r1, r2, *args, **kws)
+    return merge
+
+
+def _insert_row_before(method):
+    def insert_row_before(self, before, *args, **kws):
+        # the rows below are shifted
+        materialize(self, *[indx for indx in self.cow_shared if indx >= before])
+        return method(self, before, *args, **kws)
+    return insert_row_before
+
+
+def _get_rows(method):
+    def get_rows(self):
+        # the caller may change any row
+        materialize(self, *list(self.cow_shared))
+        return method(self)
+    return get_rows
+
+
+def _flush_row_data(method):
+    def flush_row_data(self):
+        rslt = method(self)
+        # the rows are written out and dropped
+        self.cow_shared.clear()
+        return rslt
+    return flush_row_data
+
+
+# Every entry point of the worksheet touching its rows.
+# Reading them through `row_height` or while saving needs no copy.
+WRAPPERS = {
+    'row':                  _row,
+    'write':                _write,
+    'write_rich_text':      _write,
+    'set_value':            _write,
+    'write_row':            _write,
+    'merge':                _merge,
+    'write_merge':          _merge,
+    'insert_row_before':    _insert_row_before,
+    'get_rows':             _get_rows,
+    'flush_row_data':       _flush_row_data,
+}
+
+_classes = {}
+
+
+def cow_class(cls):
+    """Returns the subclass of the worksheet class *cls* copying the shared rows before they change."""
+
+    rslt = _classes.get(cls)
+    if rslt is None:
+        attrs = dict((name, wrapper(getattr(cls, name)))
+                     for name, wrapper in WRAPPERS.iteritems() if hasattr(cls, name))
+        if 'get_rows' in attrs and isinstance(getattr(cls, 'rows', None), property):
+            # the property is bound to the original get_rows
+            attrs['rows'] = property(attrs['get_rows'])
+        rslt = _classes[cls] = type('Cow' + cls.__name__, (cls,), attrs)
+    return rslt
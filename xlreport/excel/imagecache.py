@@ -0,0 +1,187 @@
+# coding: utf-8
+
+"""
+    xlreport.excel.imagecache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Cache of images already converted to bitmap records.
+
+    Entries are keyed by the hash of the image content and the target size,
+    so the same logo is decoded only once per worker whatever sheet or report it appears in.
+    Image filters insert images through `insert_image`::
+
+        imagecache.insert_image(sheet, data, row, col, (w, h), convert)
+
+    The process-wide cache is set up with `configure`, e.g. at worker start::
+
+        imagecache.configure(cache_dir='/var/cache/xlreport', max_bytes=16 * 1024 * 1024)
+"""
+
+import os
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+
+class ImageCache(object):
+    """LRU cache of converted images, with an optional on-disk tier.
+
+    * *capacity* :          Max number of entries kept in memory.
+    * *max_bytes* :         Max total size of the entries kept in memory.
+    * *cache_dir* :         When specified, entries are also stored as files in this directory.
+    * *max_disk_bytes* :    Max total size of the files in *cache_dir*.
+                            The least recently used files are removed beyond it.
+    """
+
+    def __init__(self, capacity=64, cache_dir=None, max_disk_bytes=64 * 1024 * 1024,
+                 max_bytes=32 * 1024 * 1024):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        # total size of the entries
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def make_key(data, size):
+        """Returns the key of the image *data* converted to *size* (tuple of width, height)."""
+        return '%s_%sx%s' % (hashlib.sha1(data).hexdigest(), size[0], size[1])
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.bmp')
+
+    def get(self, key):
+        """Returns the records stored as *key*, or None."""
+
+        records = self._forget(key)
+        if records is None and self.cache_dir is not None:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    records = f.read()
+                # the mtime tells the least recently used files
+                os.utime(path, None)
+            except (IOError, OSError):
+                # not cached, or just removed by another worker
+                records = None
+        if records is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._remember(key, records)
+        return records
+
+    def put(self, key, records):
+        """Store *records* (a byte string) as *key*."""
+
+        self._forget(key)
+        self._remember(key, records)
+        if self.cache_dir is not None:
+            # write to a temporary file first, so other workers never read a partial file
+            fd, tmppath = tempfile.mkstemp(dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(records)
+                os.rename(tmppath, self._path(key))
+            except:
+                if os.path.exists(tmppath):
+                    os.remove(tmppath)
+                raise
+            self._shrink_disk()
+
+    def _shrink_disk(self):
+        """Remove the least recently used files until the directory fits in `max_disk_bytes`."""
+
+        if self.max_disk_bytes is None:
+            return
+
+        files = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.bmp'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        files.sort()
+        for mtime, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # removed by another worker
+                pass
+            total -= size
+
+    def _remember(self, key, records):
+        self.entries[key] = records
+        self.size += len(records)
+        while len(self.entries) > self.capacity or self.size > self.max_bytes:
+            dropped = self.entries.popitem(last=False)[1]
+            self.size -= len(dropped)
+
+    def _forget(self, key):
+        records = self.entries.pop(key, None)
+        if records is not None:
+            self.size -= len(records)
+        return records
+
+    def get_or_convert(self, data, size, convert):
+        """Returns the records of *data* converted to *size*.
+
+        *convert* is called as ``convert(data, size)`` only when not cached.
+        """
+
+        key = self.make_key(data, size)
+        records = self.get(key)
+        if records is None:
+            records = convert(data, size)
+            self.put(key, records)
+        return records
+
+    def clear(self):
+        """Clear the in-memory entries. Files on disk are kept."""
+        self.entries.clear()
+        self.size = 0
+
+
+# Shared by all the sheets and reports rendered in this process. See `configure`
+default_cache = ImageCache()
+
+
+def configure(**kws):
+    """Replace `default_cache` by an `ImageCache` made with *kws*, and return it.
+
+    The entries of the previous cache are dropped, the files on disk are kept.
+    """
+
+    global default_cache
+    default_cache = ImageCache(**kws)
+    return default_cache
+
+
+def insert_image(sheet, data, row, col, size, convert, cache=None):
+    """Insert the image *data* at (*row*, *col*) of *sheet*, converted through the cache.
+
+    * *size* :      Tuple of width, height the image is converted to.
+    * *convert* :   Called as ``convert(data, size)`` on a cache miss,
+                    returns the 24-bit bitmap given to ``sheet.insert_bitmap_data``.
+    * *cache* :     `ImageCache` to use, `default_cache` when omitted.
+    """
+
+    if cache is None:
+        cache = default_cache
+    bitmap = cache.get_or_convert(data, size, convert)
+    sheet.insert_bitmap_data(bitmap, row, col)
@@ -0,0 +1,213 @@
+# coding: utf-8
+
+"""
+    xlreport.excel.lint
+    ~~~~~~~~~~~~~~~~~~~
+
+    Finds invalid macros and costly constructs in a parsed template.
+
+    Usage::
+
+        python -m xlreport.excel.lint template.xls [datasource [engine]]
+
+    When a data source is given, the sheet fan-out and row counts are checked as well.
+    It's loaded with the named engine, ``jsondb`` by default.
+    See `xlreport.excel.planner`.
+"""
+
+import sys
+
+from xlreport.excel.template import Template
+
+
+ERROR, WARNING, INFO = 'error', 'warning', 'info'
+
+# Thresholds above which a construct is reported.
+MAX_LEVELS = 2
+MAX_FALLBACK = 2
+MAX_SHEETS = 1000
+
+
+class Diagnostic(object):
+    """A single finding.
+
+    *cost* is a relative figure used to rank the findings, not a time.
+    """
+
+    def __init__(self, sheet, severity, kind, message, cost=0):
+        self.sheet = sheet
+        self.severity = severity
+        self.kind = kind
+        self.message = message
+        self.cost = cost
+
+    def __repr__(self):
+        return '<Diagnostic> sheet %s: %s %s (cost %s) %s' % (
+            self.sheet, self.severity, self.kind, self.cost, self.message)
+
+
+def iter_macrodefs(meta):
+    """Yields (location, macrodef) of all the cells in the sheet, group cells included."""
+
+    for macrodef in meta.macros:
+        yield (macrodef.row, macrodef.col), macrodef
+    for gm in meta.group_macros:
+        for col, macrodef in sorted(gm.cells.iteritems()):
+            yield (gm.rstart, col), macrodef
+
+
+def check_macros(idx, meta):
+    rslt = []
+    if not meta.sheet_macro.validate():
+        rslt.append(Diagnostic(idx, ERROR, 'invalid-macro',
+                               'sheet name %r' % meta.sheet_macro.value_template))
+
+    for (row, col), macrodef in iter_macrodefs(meta):
+        macros = [macrodef.macro] + [m for e in macrodef.extras for m in e.macros]
+        if not all(m.validate() for m in macros):
+            rslt.append(Diagnostic(idx, ERROR, 'invalid-macro', 'cell (%s, %s)' % (row, col)))
+
+        for path in macrodef.macro.path_group:
+            n = len(path.fallback_chain)
+            if n > MAX_FALLBACK:
+                rslt.append(Diagnostic(idx, WARNING, 'long-fallback',
+                                       'cell (%s, %s) falls back %s times: %s' % (row, col, n - 1, path.pathstr),
+                                       cost=n))
+    return rslt
+
+
+def get_group_rows(plan):
+    """Returns {(sheet, group index): rows} from *plan*, summed over the sheets made from each template sheet."""
+
+    rslt = {}
+    for sheet in plan.sheets:
+        for i, n in enumerate(sheet.group_rows):
+            rslt[(sheet.idx, i)] = rslt.get((sheet.idx, i), 0) + n
+    return rslt
+
+
+def check_groups(idx, meta, group_rows=None):
+    rslt = []
+    for i, gm in enumerate(meta.group_macros):
+        levels = [x for x in gm.level]
+        where = 'group at row %s' % gm.rstart
+        # `GroupMacroDef.iter` nests every level, siblings too
+        depth = len(levels)
+
+        if depth > MAX_LEVELS:
+            rslt.append(Diagnostic(idx, WARNING, 'deep-group',
+                                   '%s nests %s levels: %s' % (where, depth, ', '.join(p for p, c in levels)),
+                                   cost=2 ** depth))
+
+        roots = set(prefix.split('/')[0] for prefix, cells in levels)
+        if len(roots) > 1:
+            # See the TODO of `GroupMacroDef.parse`
+            rslt.append(Diagnostic(idx, WARNING, 'mixed-group-pathes',
+                                   '%s reads unrelated pathes: %s' % (where, ', '.join(sorted(roots))),
+                                   cost=len(roots)))
+
+        nfilters = sum(len(c.extras) for c in gm.cells.itervalues())
+        if nfilters > 0 and group_rows is not None:
+            rows = group_rows.get((idx, i), 0)
+            rslt.append(Diagnostic(idx, INFO, 'group-filters',
+                                   '%s applies %s filters on each of %s rows' % (where, nfilters, rows),
+                                   cost=nfilters * rows))
+        elif nfilters > 0:
+            rslt.append(Diagnostic(idx, INFO, 'group-filters',
+                                   '%s applies %s filters on every row' % (where, nfilters),
+                                   cost=nfilters * depth))
+
+        invariant = gm.get_invariant_levels(levels)
+        if len(invariant) > 0:
+            hoisted = levels[-max(invariant):]
+            rslt.append(Diagnostic(idx, INFO, 'invariant-in-loop',
+                                   '%s: %s do not depend on the outer levels' % (where, ', '.join(p for p, c in hoisted)),
+                                   cost=len(hoisted)))
+    return rslt
+
+
+def check_sheet_macros(idx, meta):
+    if len(meta.sheet_macro.path_group) == 0:
+        return []
+
+    path = meta.sheet_macro.path_group[0].fallback_chain[0]
+    prefix = '/'.join(path[:-1])
+    invariant = [m for m in meta.macros if not m.depends_on(prefix)]
+    if len(invariant) == 0:
+        return []
+    return [Diagnostic(idx, INFO, 'invariant-in-loop',
+                       '%s cells do not depend on the sheet node %s' % (len(invariant), prefix),
+                       cost=len(invariant))]
+
+
+def check_plan(plan):
+    rslt = []
+    counts = {}
+    for sheet in plan.sheets:
+        counts[sheet.idx] = counts.get(sheet.idx, 0) + 1
+        if sheet.exceeds_limit():
+            rslt.append(Diagnostic(sheet.idx, ERROR, 'too-many-rows',
+                                   'a generated sheet has %s rows' % sheet.rows,
+                                   cost=sheet.rows))
+    for idx, n in sorted(counts.iteritems()):
+        if n > MAX_SHEETS:
+            rslt.append(Diagnostic(idx, WARNING, 'sheet-fanout',
+                                   'the sheet name path makes %s sheets' % n,
+                                   cost=n))
+    return rslt
+
+
+def lint(template, plan=None):
+    """Analyze the parsed *template*.
+
+    * *plan* :  Optional `ReportPlan` made by `plan_report` for some data source.
+                The cost of the group filters is then weighted by the actual row counts.
+
+    Returns the list of `Diagnostic`, most costly first.
+    """
+
+    rslt = []
+    group_rows = get_group_rows(plan) if plan is not None else None
+    for idx, meta in template.meta.iteritems():
+        rslt += check_macros(idx, meta)
+        rslt += check_groups(idx, meta, group_rows)
+        rslt += check_sheet_macros(idx, meta)
+    if plan is not None:
+        rslt += check_plan(plan)
+
+    severities = {ERROR: 0, WARNING: 1, INFO: 2}
+    rslt.sort(key=(lambda d: (severities[d.severity], -d.cost, d.sheet)))
+    return rslt
+
+
+def get_sheet_costs(diagnostics):
+    """Returns the list of (sheet, total cost), most costly first."""
+
+    costs = {}
+    for d in diagnostics:
+        costs[d.sheet] = costs.get(d.sheet, 0) + d.cost
+    return sorted(costs.iteritems(), key=(lambda (sheet, cost): -cost))
+
+
+def main(argv):
+    if len(argv) < 2:
+        print 'usage: %s template.xls [datasource [engine]]' % argv[0]
+        return 2
+
+    template = Template.parse(argv[1])
+    plan = None
+    if len(argv) > 2:
+        from xlreport.excel.planner import plan_report
+        source = argv[3] if len(argv) > 3 else 'jsondb'
+        plan = plan_report(template, argv[2], source)
+
+    diagnostics = lint(template, plan)
+    for d in diagnostics:
+        print 'sheet %s: %s: %s: %s' % (d.sheet, d.severity, d.kind, d.message)
+    for sheet, cost in get_sheet_costs(diagnostics):
+        print 'sheet %s: cost %s' % (sheet, cost)
+    return 1 if any(d.severity == ERROR for d in diagnostics) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,157 @@
+# coding: utf-8
+
+"""
+    xlreport.excel.planner
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Estimates the size of a report before generating it.
+
+    Only the nodes are counted, no cell value is evaluated,
+    so planning is much cheaper than `generate_report` itself.
+"""
+
+from xlreport.engine import JsonDBEngine
+from xlreport.excel.template import open_source
+
+
+# Max rows of a .xls (BIFF8) worksheet.
+XLS_MAX_ROWS = 65536
+
+
+class SheetPlan(object):
+    """Estimated shape of a single generated worksheet."""
+
+    def __init__(self, idx, template_rows):
+        self.idx = idx
+        self.template_rows = template_rows
+        self.group_rows = []
+        self.inserted_rows = 0
+        self.cells = 0
+
+    @property
+    def rows(self):
+        return self.template_rows + self.inserted_rows
+
+    def exceeds_limit(self):
+        return self.rows > XLS_MAX_ROWS
+
+    def __repr__(self):
+        return '<SheetPlan> %s, rows=%s, cells=%s' % (self.idx, self.rows, self.cells)
+
+
+class ReportPlan(object):
+    """Estimated shape of a whole report.
+
+    The byte figures are rough, based on the per cell costs below.
+    """
+
+    # BIFF record + shared string share of a written cell
+    BYTES_PER_CELL = 24
+    # Fixed records (page setup, column info, ...) of each worksheet
+    BYTES_PER_SHEET = 4096
+    # In-memory size of a cell while the workbook is being built
+    MEMORY_PER_CELL = 320
+
+    def __init__(self):
+        self.sheets = []
+
+    @property
+    def sheet_count(self):
+        return len(self.sheets)
+
+    @property
+    def total_rows(self):
+        return sum(s.rows for s in self.sheets)
+
+    @property
+    def total_cells(self):
+        return sum(s.cells for s in self.sheets)
+
+    def estimate_size(self):
+        """Returns the estimated size of the output file in bytes."""
+        return self.sheet_count * self.BYTES_PER_SHEET + self.total_cells * self.BYTES_PER_CELL
+
+    def estimate_memory(self):
+        """Returns the estimated peak memory in bytes when all sheets are kept in one workbook."""
+        return self.estimate_size() + self.total_cells * self.MEMORY_PER_CELL
+
+    def get_oversized_sheets(self):
+        """Returns the sheets exceeding the row limit of .xls."""
+        return [s for s in self.sheets if s.exceeds_limit()]
+
+    def __repr__(self):
+        return '<ReportPlan> sheets=%s, cells=%s, size=%s' % (
+            self.sheet_count, self.total_cells, self.estimate_size())
+
+
+def count_rows(levels, ctx, invariant, memo):
+    """Counts the rows `GroupMacroDef.iter` would yield for *levels*."""
+
+    if len(levels) == 0:
+        return 1
+
+    prefix, cells = levels[0]
+    nodes = list(ctx.query(prefix))
+    if len(nodes) == 0:
+        ctx.clear_children(prefix)
+        return 1
+
+    rest = levels[1:]
+    total = 0
+    for node in nodes:
+        ctx.cache(prefix, node)
+        ctx.clear_children(prefix)
+        if len(rest) in invariant:
+            if len(rest) not in memo:
+                memo[len(rest)] = count_rows(rest, ctx, invariant, memo)
+            total += memo[len(rest)]
+        else:
+            total += count_rows(rest, ctx, invariant, memo)
+    return total
+
+
+def plan_sheet(idx, meta, ctx):
+    plan = SheetPlan(idx, meta.nrows)
+    plan.cells = len(meta.macros)
+    for gm in meta.group_macros:
+        levels = [x for x in gm.level]
+        n = count_rows(levels, ctx, gm.get_invariant_levels(levels), {})
+        plan.group_rows.append(n)
+        # same as the insert_rows calculation of `Template._make_sheet`
+        plan.inserted_rows += max(0, n - (gm.rend - gm.rstart) - 1)
+        plan.cells += n * (len(gm.cells) + (1 if gm.rowno_col is not None else 0))
+    return plan
+
+
+def plan_report(template, doc, source=JsonDBEngine):
+    """Estimates the report `generate_report` would make.
+
+    * *template* :  Parsed `Template`.
+    * *doc* :       Data source path.
+    * *source* :    Engine (or its registered name) loading *doc*. See `Template.apply`
+
+    Returns a `ReportPlan`.
+    """
+
+    rslt = ReportPlan()
+    ctx = template.ctx
+    ctx.engine = open_source(source, doc)
+    ctx.root = -1
+    try:
+        for idx, meta in template.meta.iteritems():
+            if len(meta.sheet_macro.path_group) == 0:
+                rslt.sheets.append(plan_sheet(idx, meta, ctx))
+                continue
+
+            path = meta.sheet_macro.path_group[0].fallback_chain[0]
+            pathstr = '/'.join(path[:-1])
+            for node in ctx.engine.xpath(-1, pathstr):
+                ctx.cache(pathstr, node)
+                rslt.sheets.append(plan_sheet(idx, meta, ctx))
+                ctx.clear_children(pathstr)
+    finally:
+        ctx.clear_cache()
+        ctx.root = None
+        ctx.engine.close()
+        del ctx.engine
+    return rslt
@@ -0,0 +1,62 @@
+# coding: utf-8
+
+"""
+    xlreport.excel.prepared
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Template workbooks loaded once and cloned in-process.
+"""
+
+import copy
+
+from template import Template
+from cow import ROWS_ATTR
+
+
+class PreparedTemplate(object):
+    """A template workbook which is read and decoded only once.
+
+    `generate_report` normally starts with `xlpy.create_copy`, which re-reads
+    the template file every time. A long-lived worker can instead keep a
+    `PreparedTemplate` around and pass it as *template_path*::
+
+        prepared = PreparedTemplate('template.xls')
+        for doc, dest in jobs:
+            for name in generate_report(doc, prepared, dest):
+                pass
+
+    NOTE: the parsed `Template` carries the evaluation context,
+          so a prepared template must not be shared between threads.
+    """
+
+    def __init__(self, template_path, ctx=None):
+        import xlpy
+
+        self.template_path = template_path
+        self.workbook = xlpy.create_copy(template_path)
+        self.template = Template.parse(template_path, ctx)
+        self.copies = 0
+
+    def _shared_memo(self):
+        """Returns the deepcopy memo sharing the rows of the reference sheets.
+
+        The reference sheets of multiple sheet templates are only ever copied from
+        (see `generate_sheet`), so their row records are read-only and are shared
+        by all the copies. Everything else, the style table included, is modified
+        while rendering and is duplicated.
+        """
+
+        memo = {}
+        for idx, meta in self.template.meta.iteritems():
+            if len(meta.sheet_macro.path_group) == 0:
+                continue
+            rows = getattr(self.workbook.get_sheet(idx), ROWS_ATTR, None)
+            if isinstance(rows, dict):
+                memo[id(rows)] = rows
+        return memo
+
+    def new_workbook(self):
+        """Returns a fresh writable copy of the template workbook."""
+
+        self.copies += 1
+        return copy.deepcopy(self.workbook, self._shared_memo())
@@ -0,0 +1,89 @@
+# coding: utf-8
+
+"""
+    xlreport.excel.rowformat
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Formatting of template rows, resolved once per sheet.
+
+    Every generated row of a group is formatted after a template row.
+    Instead of looking the template row up again for each generated row,
+    its height, outline state and XF indices are read once and stamped onto the new rows.
+
+    This relies on the private attributes of the xlwt row.
+    When they're not where we expect, `RowFormats.get` returns None
+    and `write_rows` falls back to ``write_row``.
+"""
+
+import sys
+
+
+# Height, outline and default format of a `xlpy.xlwt.Row.Row`
+ROW_ATTRS = (
+    'height', 'has_default_height', 'height_mismatch',
+    'level', 'collapse', 'hidden',
+    '_Row__height_in_pixels', '_Row__xf_index', '_Row__has_default_xf_index',
+)
+
+# Cells of a row, col -> cell
+CELLS_ATTR = '_Row__cells'
+
+
+def get_blank_cell(row):
+    """Returns the blank cell class going with *row*, which its module imports."""
+    return getattr(sys.modules.get(type(row).__module__), 'BlankCell', None)
+
+
+def is_supported(row):
+    """Returns True if *row* keeps its format where we expect."""
+    return (all(hasattr(row, name) for name in ROW_ATTRS + (CELLS_ATTR,))
+            and get_blank_cell(row) is not None)
+
+
+class RowFormat(object):
+    """Height, outline state and cell XF indices of a single template row."""
+
+    def __init__(self, row):
+        self.attrs = [(name, getattr(row, name)) for name in ROW_ATTRS]
+        self.cells = sorted((col, cell.xf_idx) for col, cell in getattr(row, CELLS_ATTR).iteritems())
+        self.blank_cell = get_blank_cell(row)
+
+    def apply(self, row):
+        """Format *row* like the template row."""
+
+        for name, value in self.attrs:
+            setattr(row, name, value)
+
+        cells = getattr(row, CELLS_ATTR)
+        for col, xf_idx in self.cells:
+            cell = cells.get(col)
+            if cell is None:
+                row.insert_cell(col, self.blank_cell(row.get_index(), col, xf_idx))
+            else:
+                cell.xf_idx = xf_idx
+        if len(self.cells) > 0:
+            row._Row__adjust_bound_col_idx(self.cells[0][0], self.cells[-1][0])
+
+
+class RowFormats(object):
+    """The `RowFormat` of the template rows of *sheet*, resolved on first use.
+
+    Inserting rows shifts the template rows, so `clear` must be called after `insert_row_before`.
+    """
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.formats = {}
+
+    def get(self, ref_row):
+        """Returns the `RowFormat` of *ref_row*,
+        or None when the worksheet doesn't keep its rows the way we expect.
+        """
+
+        if ref_row not in self.formats:
+            row = self.sheet.row(ref_row)
+            self.formats[ref_row] = RowFormat(row) if is_supported(row) else None
+        return self.formats[ref_row]
+
+    def clear(self):
+        self.formats.clear()
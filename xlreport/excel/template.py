@@ -16,9 +16,9 @@
 
 import os
 import re
-from xlpy import xlrd
 
 from xlreport.engine import *
+from xlreport.engine.projection import Projection
 from xlreport import context
 
 import logging
@@ -29,6 +29,11 @@ class TemplateError(Exception):
     pass
 
 
+def is_under(path, prefix):
+    """Returns True if *path* is *prefix* itself or lies beneath it."""
+    return path == prefix or path.startswith(prefix + '/')
+
+
 class Path(object):
     """Single query path."""
 
@@ -59,9 +64,14 @@ class Path(object):
         return self.mode == Path.MODE_GROUP and self.pathstr.lower() == 'no'
 
     def validate(self):
-        """
-        """
-        # TODO
+        """Returns True if every alternative of the fallback chain is a well formed path."""
+
+        for alt in self.pathstr.split('|'):
+            alt = alt.strip()
+            if len(alt) == 0:
+                return False
+            if any(len(x) == 0 for x in re.split(r'(?<!@)\.', alt)):
+                return False
         return True
 
     @staticmethod
@@ -110,6 +120,14 @@ class Macro(object):
         chains = [p.fallback_chain for p in self.path_group]
         return chains and reduce(combine, chains) or []
 
+    def get_data_pathes(self):
+        """Returns the pathes which actually read the data source (literals excluded)."""
+        return [chain[0] for chain in self.get_pathes() if chain[-1] != '.']
+
+    def depends_on(self, prefix):
+        """Returns True if the value of this cell changes along with the node at *prefix*."""
+        return any(is_under(path, prefix) for path in self.get_data_pathes())
+
     def evaluate(self, values):
         """*values* リストで指定した値で、パスを置換してセルに設定する値を取得する。"""
 
@@ -175,9 +193,13 @@ class Macro(object):
 
     def validate(self):
         """All the macros in the same group must be at the same level.
+
+        Here we only check the pathes themselves,
+        and that a cell has at most one path which might have multiple values.
         """
-        # TODO
-        return True
+        if len([p for p in self.path_group if p.mode == Path.MODE_GROUP]) > 1:
+            return False
+        return all(p.validate() for p in self.path_group)
 
 
 class Extra(object):
@@ -209,6 +231,9 @@ class Extra(object):
     def get_args_value(self, ctx):
         return [macro.get_value(ctx) for macro in self.macros]
 
+    def depends_on(self, prefix):
+        return any(macro.depends_on(prefix) for macro in self.macros)
+
     @classmethod
     def parse(cls, extrastr):
         return cls(extrastr)
@@ -221,10 +246,15 @@ class SheetMetaInfo(object):
         self.sheet_macro = None
         self.macros = []
         self.group_macros = []
+        self.nrows = 0
 
     def is_static(self):
         return len(self.group_macros) == 0
 
+    def is_untouched(self):
+        """Returns True if the sheet can be copied from the template as it is."""
+        return self.is_static() and len(self.macros) == 0
+
 
 class MacroDef(object):
     """ Represents a Cell.
@@ -242,6 +272,9 @@ class MacroDef(object):
     def get_max_prefix(self):
         return self.macro.get_max_prefix()
 
+    def depends_on(self, prefix):
+        return self.macro.depends_on(prefix) or any(e.depends_on(prefix) for e in self.extras)
+
     def __repr__(self):
         return '<MacroDef> %s, %s, %s' % (self.row, self.col, '; '.join(['.'.join(x) for x in self.macro.get_pathes()]))
 
@@ -280,6 +313,9 @@ class GroupMacroDef(object):
     """ Represents a row or a col block.
     """
 
+    # Min number of top level nodes worth sharding across processes.
+    SHARD_MIN_ROWS = 5000
+
     def __init__(self, rstart, rend, mode, macros):
         self.rstart = rstart
         self.rend = rend
@@ -315,9 +351,13 @@ class GroupMacroDef(object):
             self.cells[col] = cell = MacroDef(0, col, macro, *extras)
             self.level.append(cell)
 
-    def iter(self, levels, ctx, engine=XmlEngine):
+    def iter(self, levels, ctx, engine=XmlEngine, counters=None, invariant=(), memo=None, nodes=None):
         """ Generator to yield all the levels one row at a time, and set the xml context.
         Also it yields information of the previous level.
+
+        *invariant* holds the number of remaining levels whose rows don't depend on
+        any outer level, so they are evaluated once and replayed from *memo*.
+        *nodes* are the nodes of the first level, when already queried.
         """
         
         if len(levels) == 0:
@@ -325,53 +365,198 @@ class GroupMacroDef(object):
             return
 
         prefix, cells = levels[0]
-        nodes = list(ctx.query(prefix))
+        if nodes is None:
+            nodes = list(ctx.query(prefix))
         if not isinstance(nodes, (list, tuple, set)):
             nodes = [nodes]
         if len(nodes) == 0:
             ctx.clear_children(prefix)
+            self._count(counters, 'evaluated', len(cells))
             yield [(c.col, c.get_value(ctx)) for c in cells]
             return
+        for row in self._iter_nodes(levels, nodes, ctx, engine, counters, invariant, memo):
+            yield row
+        return
+
+    def _iter_nodes(self, levels, nodes, ctx, engine, counters, invariant, memo):
+        prefix, cells = levels[0]
         for node in nodes:
             ctx.cache(prefix, node)
             ctx.clear_children(prefix)
             data = [(c.col, c.get_value(ctx)) for c in cells]
+            self._count(counters, 'evaluated', len(cells))
             dummy = [(col, ('', [])) for col, value in data]
-            for i, tmp in enumerate(self.iter(levels[1:], ctx, engine)):
+            for i, tmp in enumerate(self._iter_inner(levels[1:], ctx, engine, counters, invariant, memo)):
                 if i == 0:
                     yield data + tmp
                 else:
                     yield dummy + tmp
         return
 
-    def iter_data(self, ctx, engine=XmlEngine):
+    def _iter_inner(self, levels, ctx, engine, counters, invariant, memo):
+        if len(levels) not in invariant:
+            return self.iter(levels, ctx, engine, counters, invariant, memo)
+
+        key = len(levels)
+        if key in memo:
+            rows, cost = memo[key]
+            self._count(counters, 'saved', cost)
+            return rows
+
+        before = counters.get('evaluated', 0) if counters is not None else 0
+        rows = list(self.iter(levels, ctx, engine, counters, invariant, memo))
+        after = counters.get('evaluated', 0) if counters is not None else 0
+        memo[key] = rows, after - before
+        return rows
+
+    @staticmethod
+    def _count(counters, name, n):
+        if counters is not None:
+            counters[name] = counters.get(name, 0) + n
+
+    def get_invariant_levels(self, levels):
+        """Returns the set of *k* where the last *k* levels never read any node of the outer levels.
+        """
+
+        rslt = set([])
+        for k in xrange(1, len(levels)):
+            outer = [prefix for prefix, cells in levels[:-k]]
+            inner = [c for prefix, cells in levels[-k:] for c in cells]
+            if not any(c.depends_on(o) for o in outer for c in inner):
+                rslt.add(k)
+        return rslt
+
+    def iter_data(self, ctx, engine=XmlEngine, counters=None, workers=0):
+        """Yields the rows of this group.
+
+        With *workers* > 1, a top level of at least `SHARD_MIN_ROWS` nodes is
+        split into row ranges which are evaluated in that many processes.
+        The workers are forked, so on platforms without fork the rows are always
+        evaluated here.
+        """
+
         levels = [x for x in self.level]
-        for row in self.iter(levels, ctx, engine):
+        invariant = self.get_invariant_levels(levels)
+        nodes = None
+        if workers > 1 and len(levels) > 0 and hasattr(os, 'fork'):
+            nodes = list(ctx.query(levels[0][0]))
+            if len(nodes) >= self.SHARD_MIN_ROWS:
+                for row in self.iter_sharded(levels, nodes, ctx, engine, invariant, workers):
+                    yield row
+                return
+
+        for row in self.iter(levels, ctx, engine, counters, invariant, {}, nodes):
             yield row
 
+    def iter_sharded(self, levels, nodes, ctx, engine, invariant, workers):
+        """Evaluates the top level *nodes* in worker processes.
+
+        The workers are forked and inherit the context and *nodes* as they are,
+        only the row ranges and the resulting rows are pickled.
+        Without fork they would start with no job, so `iter_data` never gets here then.
+        The ranges come back in order, so the rows are the same as a serial run.
+
+        Forking is safe as far as the open files go:
+
+        * The output stream is never written by the workers, and they leave through ``os._exit``,
+          so the buffers they inherited are never flushed twice.
+        * The data source is only read. A data source holding an OS level handle, whose file offset
+          would be shared by all the processes, must provide ``reopen()``.
+          Each worker calls it first to get a handle of its own.
+        """
+
+        # only needed by large groups
+        import multiprocessing
+
+        global _shard_job
+
+        count = len(nodes)
+        size = max(1, count // (workers * 4))
+        ranges = [(start, min(start + size, count)) for start in xrange(0, count, size)]
+        _shard_job = (self, levels, nodes, ctx, engine, invariant)
+        pool = multiprocessing.Pool(workers, _init_shard_worker)
+        try:
+            for rows in pool.imap(_eval_shard, ranges):
+                for row in rows:
+                    yield row
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            _shard_job = None
+
     def get_row_data(self, ctx):
         return [(col, cell.macro.get_value(ctx)) for col, cell in self.cells.iteritems()]
 
 
+# (group, levels, top level nodes, ctx, engine, invariant) of the group being sharded.
+# Set before the workers are forked, so it doesn't need to be pickled.
+_shard_job = None
+
+
+def _init_shard_worker():
+    """Gives the worker its own handle on the data source. See `GroupMacroDef.iter_sharded`"""
+
+    ctx = _shard_job[3]
+    reopen = getattr(ctx.engine, 'reopen', None)
+    if reopen is not None:
+        reopen()
+
+
+def _eval_shard(rng):
+    """Evaluates the top level nodes in the range *rng* of the group being sharded."""
+
+    gm, levels, nodes, ctx, engine, invariant = _shard_job
+    start, end = rng
+    return list(gm._iter_nodes(levels, nodes[start:end], ctx, engine, None, invariant, {}))
+
+
+def open_source(source, doc, projection=None):
+    """Opens the data source *doc* with the engine *source* (or its registered name).
+
+    Engines providing ``open(doc, projection)`` are opened through it,
+    others through ``load(doc)``, which can't skip anything.
+    Only the xml engine supports a *projection* so far.
+    """
+
+    source = get_engine(source)
+    if getattr(source, 'open', None) is not None:
+        return source.open(doc, projection)
+    if projection is not None:
+        raise TemplateError('%r cannot load a projection' % source)
+    return source.load(doc)
+
+
 class Template(object):
     """The template."""
 
-    def __init__(self):
+    def __init__(self, ctx=None):
         self.meta = {}
         self.tmp_groups = {}
-        self.ctx = context.create()
+        self.ctx = ctx if ctx is not None else context.create()
+        # number of macro evaluations done / avoided by hoisting
+        self.counters = {'evaluated': 0, 'saved': 0}
+        # number of processes to evaluate large groups with. See `GroupMacroDef.iter_data`
+        self.shard_workers = 0
 
     @classmethod
-    def parse(cls, template_path):
-        """Read and parse the template file specified by *template_path*."""
+    def parse(cls, template_path, ctx=None):
+        """Read and parse the template file specified by *template_path*.
 
-        self = cls()
+        *ctx* is the evaluation context to use, e.g. `xlreport.stack_context.create()`.
+        Defaults to `xlreport.context.create()`.
+        """
+
+        from xlpy import xlrd
+
+        self = cls(ctx)
         w = xlrd.open_workbook(template_path, formatting_info=True)
         for idx, sht in enumerate(w.sheets()):
             self.tmp_groups = {}
             sheet_macro = Macro(sht.name)
             self.meta[idx] = meta = SheetMetaInfo()
             meta.sheet_macro = sheet_macro
+            meta.nrows = sht.nrows
 
             for rx in xrange(sht.nrows):
                 cols = ((cx, sht.cell_value(rx, cx)) for cx in xrange(sht.ncols))
@@ -425,14 +610,88 @@ class Template(object):
                         rslt.add(chain[1])
         return rslt
 
-    def _make_sheet(self, idx, meta, is_multiple=False, engine=XmlEngine):
+    def get_invariant_macros(self, meta, prefix):
+        """Evaluates the macros of *meta* which don't depend on the node at *prefix*.
+
+        Returns a dict of `Macro` -> value, to be passed to `_make_sheet`.
+        """
+
+        rslt = {}
+        macros = []
+        for macrodef in meta.macros:
+            macros.append(macrodef.macro)
+            for extra in macrodef.extras:
+                macros += extra.macros
+        for macro in macros:
+            if not macro.depends_on(prefix):
+                rslt[macro] = macro.get_value(self.ctx)
+                self.counters['evaluated'] += 1
+        return rslt
+
+    def _eval(self, macro, invariants):
+        if invariants is not None and macro in invariants:
+            self.counters['saved'] += 1
+            return invariants[macro]
+        self.counters['evaluated'] += 1
+        return macro.get_value(self.ctx)
+
+    def _make_cell(self, macrodef, invariants, engine):
+        attrib = {
+            'row'       : str(macrodef.row),
+            'col'       : str(macrodef.col),
+            'ori_row'   : str(macrodef.row),
+            'ori_col'   : str(macrodef.col),
+            'value'     : self._eval(macrodef.macro, invariants)
+        }
+        nodecell = engine.make_element('Cell', **attrib)
+        if len(macrodef.extras) > 0:
+            node_extras = engine.make_element('Extras')
+            for extra in macrodef.extras:
+                attrib = {'func': extra.funcname, 'argn': str(len(extra.macros))}
+                for i, arg in enumerate([self._eval(m, invariants) for m in extra.macros]):
+                    attrib['arg%s' % i] = arg
+                node_extra = engine.make_element('Extra', **attrib)
+                engine.append_as_list(node_extras, node_extra)
+            engine.append(nodecell, node_extras)
+        return nodecell
+
+    def get_projection(self):
+        """Returns the `Projection` of all the pathes this template may read."""
+
+        macros = []
+        for idx, meta in self.meta.iteritems():
+            macros.append(meta.sheet_macro)
+            macrodefs = meta.macros + [c for gm in meta.group_macros for c in gm.cells.itervalues()]
+            for macrodef in macrodefs:
+                macros.append(macrodef.macro)
+                for extra in macrodef.extras:
+                    macros += extra.macros
+
+        rslt = Projection()
+        for macro in macros:
+            for chain in macro.get_pathes():
+                if chain[-1] != '.':
+                    rslt.add(*chain)
+        return rslt
+
+    def _make_sheet(self, idx, meta, is_multiple=False, engine=XmlEngine, invariants=None):
         attrib = {
             'name'      : meta.sheet_macro.get_value(self.ctx, True),
             'copy_from' : str(idx),
-            'multiple'  : str(is_multiple)
+            'multiple'  : str(is_multiple),
+            'static'    : str(meta.is_static())
         }
         nodesheet = engine.make_element('Sheet', **attrib)
 
+        if meta.is_static():
+            # No rows will be inserted, so cells are written in place without any priors.
+            if not meta.is_untouched():
+                cells = engine.make_element("Cells")
+                for macrodef in meta.macros:
+                    engine.append_as_list(cells, self._make_cell(macrodef, invariants, engine))
+                engine.append(nodesheet, cells)
+            return nodesheet
+
         priors = engine.make_element("Priors")
         cells = engine.make_element("Cells")
 
@@ -448,23 +707,7 @@ class Template(object):
 
         for macrodef in meta.macros:
             # TODO: offset
-            attrib = {
-                'row'       : str(macrodef.row), #str(macrodef.row + get_offset(macrodef.row)),
-                'col'       : str(macrodef.col),
-                'ori_row'   : str(macrodef.row),
-                'ori_col'   : str(macrodef.col),
-                'value'     : macrodef.macro.get_value(self.ctx)
-            }
-            nodecell = engine.make_element('Cell', **attrib)
-            if len(macrodef.extras) > 0:
-                node_extras = engine.make_element('Extras')
-                for extra in macrodef.extras:
-                    attrib = {'func': extra.funcname, 'argn': str(len(extra.macros))}
-                    for i, arg in enumerate(extra.get_args_value(self.ctx)):
-                        attrib['arg%s' % i] = arg
-                    node_extra = engine.make_element('Extra', **attrib)
-                    engine.append_as_list(node_extras, node_extra)
-                engine.append(nodecell, node_extras)
+            nodecell = self._make_cell(macrodef, invariants, engine)
             pending_cells.append(nodecell)
             attrib = {
                 'row'       : str(macrodef.row),
@@ -496,7 +739,7 @@ class Template(object):
             node_clearcell = engine.make_element('clear_cell', **attrib)
             engine.append_as_list(priors, node_clearcell)
 
-            for i, data in enumerate(gm.iter_data(self.ctx, engine)):
+            for i, data in enumerate(gm.iter_data(self.ctx, engine, self.counters, self.shard_workers)):
                 if not any(((col, (value, extras))
                             for (col, (value, extras)) in data
                             if len(value) > 0 or len(extras) > 0)):
@@ -562,19 +805,24 @@ class Template(object):
         engine.append(nodesheet, cells)
         return nodesheet
 
-    def apply(self, doc, engine=XmlEngine):
+    def apply(self, doc, engine=XmlEngine, projection=None, source=JsonDBEngine):
         """Generate information with data source specified by *doc*.
 
-        * *doc* :       Data source path.
-        * *engine* :    Data source engine.
+        * *doc* :           Data source path.
+        * *engine* :        Data source engine.
+        * *projection* :    When specified, only these pathes are loaded. See `get_projection`.
+        * *source* :        Engine (or its registered name) loading *doc*. See `open_source`
         """
 
-        self.ctx.engine = JsonDBEngine.load(doc)
+        self.ctx.engine = open_source(source, doc, projection)
         self.ctx.root = -1
+        # counted per report, a prepared template renders many of them
+        self.counters = {'evaluated': 0, 'saved': 0}
+        sheet_engine = get_engine(JsonEngine)
         for idx, meta in self.meta.iteritems():
             print 'generating data for sheet %s' % idx
             if len(meta.sheet_macro.path_group) == 0:
-                nodesheet = self._make_sheet(idx, meta, engine=JsonEngine)
+                nodesheet = self._make_sheet(idx, meta, engine=sheet_engine)
                 yield nodesheet
             else:
                 # Oh. sheet name contains xpath
@@ -582,12 +830,14 @@ class Template(object):
                 pathstr = '/'.join(path[:-1])
                 prop = path[-1]
                 print 'pathstr=', pathstr
+                invariants = self.get_invariant_macros(meta, pathstr)
                 for i, node in enumerate(self.ctx.engine.xpath(-1, pathstr)):
                     print 'sheet obj %s' % i
                     # The trick: cache the current path,
                     #            so no need to modify the xpath prefix
                     self.ctx.cache(pathstr, node)
-                    nodesheet = self._make_sheet(idx, meta, is_multiple=True, engine=JsonEngine)
+                    nodesheet = self._make_sheet(idx, meta, is_multiple=True, engine=sheet_engine,
+                                                 invariants=invariants)
                     self.ctx.clear_children(pathstr)
                     del node
                     yield nodesheet
@@ -0,0 +1,126 @@
+# coding: utf-8
+
+"""
+    xlreport.stack_context
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Evaluation context keeping the current nodes in a scope stack.
+
+    It has the same interface as the context from `xlreport.context.create()`,
+    but entering and leaving a node doesn't scan the cached pathes:
+
+    * `cache` pushes a frame (dropping the frames entered after the same prefix last time),
+    * `clear_children` pops the frames entered after the prefix,
+    * `get` and `query` look up the ancestors of a path, which are computed once per path.
+"""
+
+
+class Frame(object):
+    """A node entered by a loop, and the nodes searched beneath it."""
+
+    __slots__ = ('prefix', 'node', 'found')
+
+    def __init__(self, prefix, node):
+        self.prefix = prefix
+        self.node = node
+        self.found = {}
+
+
+class StackContext(object):
+    """Scope stack of the nodes being iterated."""
+
+    def __init__(self):
+        self.engine = None
+        self.root = None
+        self.frames = []
+        self.index = {}
+        self.found = {}
+        self._ancestors = {}
+
+    def ancestors(self, path):
+        """Returns *path* and all its ancestors, deepest first."""
+
+        rslt = self._ancestors.get(path)
+        if rslt is None:
+            parts = path.split('/')
+            rslt = ['/'.join(parts[:i]) for i in xrange(len(parts), 0, -1)]
+            self._ancestors[path] = rslt
+        return rslt
+
+    def _truncate(self, pos):
+        for frame in self.frames[pos:]:
+            del self.index[frame.prefix]
+        del self.frames[pos:]
+
+    def _base(self, path, include_self):
+        """Returns the deepest frame holding *path* or one of its ancestors."""
+
+        for prefix in self.ancestors(path):
+            if prefix == path and not include_self:
+                continue
+            pos = self.index.get(prefix)
+            if pos is not None:
+                return self.frames[pos]
+        return None
+
+    def _relative(self, frame, path):
+        if frame is None:
+            return self.root, path
+        return frame.node, path[len(frame.prefix) + 1:]
+
+    def cache(self, prefix, node):
+        """Enter *node* as the current node of *prefix*."""
+
+        pos = self.index.get(prefix)
+        if pos is not None:
+            self._truncate(pos)
+        self.index[prefix] = len(self.frames)
+        self.frames.append(Frame(prefix, node))
+
+    def clear_children(self, prefix):
+        """Leave all the nodes entered after *prefix*."""
+
+        pos = self.index.get(prefix)
+        if pos is not None:
+            self._truncate(pos + 1)
+
+    def clear_cache(self):
+        self._truncate(0)
+        self.found = {}
+
+    def query(self, prefix):
+        """Returns the nodes at *prefix*, relative to the current nodes of its ancestors."""
+
+        base, rel = self._relative(self._base(prefix, False), prefix)
+        return self.engine.xpath(base, rel)
+
+    def find(self, path, search=True):
+        """Returns the current node at *path*.
+
+        Otherwise the node found by an earlier search is returned.
+        When there is none and *search* is True, the first node found is returned
+        and remembered until the scope it was found in is left.
+        """
+
+        frame = self._base(path, True)
+        if frame is not None and frame.prefix == path:
+            return frame.node
+
+        found = frame.found if frame is not None else self.found
+        if path not in found:
+            if not search:
+                return None
+            base, rel = self._relative(frame, path)
+            nodes = list(self.engine.xpath(base, rel))
+            found[path] = nodes[0] if len(nodes) > 0 else None
+        return found[path]
+
+    def get(self, path, prop, search=True):
+        node = self.find(path, search)
+        if node is None:
+            return ''
+        return self.engine.get_child(node, prop)
+
+
+def create():
+    return StackContext()
@@ -2,6 +2,7 @@
 
 import os
 import zipfile
+import tempfile
 
 original_zipinfo = zipfile.ZipInfo
 original_sep = os.sep
@@ -15,6 +16,91 @@ class MyZipInfo(original_zipinfo):
 zipfile.ZipInfo = MyZipInfo
 
 
+class StreamWriter(object):
+    """Wraps a writable file-like object or a callable receiving the written chunks.
+
+    Counts the bytes written, so `tell` works even on unseekable streams
+    such as sockets or HTTP responses.
+    """
+
+    def __init__(self, dest):
+        self.dest = dest
+        self.pos = 0
+        if hasattr(dest, 'write'):
+            self._write = dest.write
+        else:
+            self._write = dest
+
+    def write(self, data):
+        if len(data) == 0:
+            return
+        self._write(data)
+        self.pos += len(data)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        if hasattr(self.dest, 'flush'):
+            self.dest.flush()
+
+
+class AtomicFile(object):
+    """File written under a temporary name in the directory of *path*,
+    and renamed to *path* by `commit`.
+
+    *path* never holds a partially written file, and `discard` leaves nothing behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        fd, self.tmp_path = tempfile.mkstemp(prefix='.xlreport-', suffix='.tmp',
+                                             dir=os.path.dirname(os.path.abspath(path)))
+        # mkstemp makes the file readable by the owner only, give it the usual permissions
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(self.tmp_path, 0666 & ~umask)
+        self.file = os.fdopen(fd, 'wb')
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def commit(self):
+        self.file.close()
+        if os.name == 'nt' and os.path.exists(self.path):
+            # rename doesn't replace an existing file on Windows
+            os.remove(self.path)
+        os.rename(self.tmp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class LazyAttr(object):
+    """Stands for the attribute *attr* of the module *modname*,
+    which is imported on first use.
+    """
+
+    def __init__(self, modname, attr):
+        self.modname = modname
+        self.attr = attr
+
+    def resolve(self):
+        module = __import__(self.modname, fromlist=[self.attr])
+        return getattr(module, self.attr)
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __call__(self, *args, **kws):
+        return self.resolve()(*args, **kws)
+
+    def __repr__(self):
+        return '<LazyAttr> %s.%s' % (self.modname, self.attr)
+
+
 def ensure_unicode(s):
     if isinstance(s, unicode):
         return s